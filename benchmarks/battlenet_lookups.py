@@ -0,0 +1,74 @@
+"""
+Concurrent Battle.net lookups through the previous requests_oauthlib client and the aiohttp BattleNetClient.
+
+    python -m benchmarks.battlenet_lookups [lookups] [latency]
+
+Both clients hit the local stub of the tests, answering after latency seconds (0.05 by default).
+The previous client blocked the event loop for every request, the worst loop lag shows what the shards went through.
+"""
+import asyncio
+import os
+import sys
+import time
+
+from tests.battlenet_stub import BattleNetStub, configure_django
+
+configure_django()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from oauthlib.oauth2 import BackendApplicationClient  # noqa: E402
+from requests_oauthlib import OAuth2Session  # noqa: E402
+
+from utils.battlenet_util import BattleNetClient  # noqa: E402
+
+# The stub speaks plain HTTP
+os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+
+
+async def loop_lag(stop, lags):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+
+async def measure(name, lookups):
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.ensure_future(loop_lag(stop, lags))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await lookups()
+    wall = time.perf_counter() - start
+    stop.set()
+    await lag_task
+    print(f"{name:<16} {wall:.3f}s, worst loop lag {max(lags, default=0.0) * 1000:.1f}ms")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    stub = BattleNetStub(data_delay=float(sys.argv[2]) if len(sys.argv) > 2 else 0.05)
+    url = stub.start_in_thread()
+
+    # What execute_battlenet_request did before, a blocking OAuth2Session.get inside the coroutine
+    session = OAuth2Session(client=BackendApplicationClient(client_id=settings.SOCIAL_AUTH_BATTLENET_OAUTH2_US_KEY))
+    session.fetch_token(token_url=f"{url}/oauth/token", client_id=settings.SOCIAL_AUTH_BATTLENET_OAUTH2_US_KEY,
+                        client_secret=settings.SOCIAL_AUTH_BATTLENET_OAUTH2_US_SECRET)
+
+    async def old_lookup():
+        return session.get(f"{url}/data")
+
+    cache.clear()
+    client = BattleNetClient("us", token_url=f"{url}/oauth/token")
+    await client.get_token()
+
+    print(f"{count} concurrent lookups, {stub.data_delay * 1000:.0f}ms of latency each")
+    await measure("requests_oauthlib", lambda: asyncio.gather(*(old_lookup() for _ in range(count))))
+    await measure("BattleNetClient", lambda: asyncio.gather(*(client.get(f"{url}/data") for _ in range(count))))
+    await client.close()
+    stub.stop_thread()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,77 @@
+"""
+CPU used per concurrent music stream by the PCM and Opus paths of cogs/music.py.
+
+    python -m benchmarks.music_audio <audio file> [streams]
+
+Needs ffmpeg and the bot requirements. Every stream is read as fast as possible from its own thread,
+the way the voice player thread reads it, and PCM frames are encoded to Opus as VoiceClient does.
+The passthrough path is only measured when the file is already Opus (.webm, .opus or .ogg).
+"""
+import resource
+import sys
+import threading
+import time
+
+import discord
+from discord.opus import Encoder
+
+from cogs.music import YTDLSource, YTDLOpusSource
+
+FRAME_DURATION = 0.02
+
+
+def play_pcm(path):
+    source = YTDLSource(discord.FFmpegPCMAudio(path), data={}, requester=None)
+    source.volume = .5
+    encoder = Encoder()
+    frames = 0
+    while True:
+        frame = source.read()
+        if not frame:
+            break
+        encoder.encode(frame, Encoder.SAMPLES_PER_FRAME)
+        frames += 1
+    source.cleanup()
+    return frames
+
+
+def play_opus(path, volume, codec=None):
+    source = YTDLOpusSource(path, data={'codec': codec}, requester=None, volume=volume)
+    frames = 0
+    while source.read():
+        frames += 1
+    source.cleanup()
+    return frames
+
+
+def measure(name, play, streams):
+    frames = []
+    threads = [threading.Thread(target=lambda: frames.append(play())) for _ in range(streams)]
+    before_self = resource.getrusage(resource.RUSAGE_SELF)
+    before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    after_self = resource.getrusage(resource.RUSAGE_SELF)
+    after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    bot_cpu = after_self.ru_utime + after_self.ru_stime - before_self.ru_utime - before_self.ru_stime
+    ffmpeg_cpu = after_children.ru_utime + after_children.ru_stime - before_children.ru_utime - before_children.ru_stime
+    audio_minutes = sum(frames) * FRAME_DURATION / 60
+    print(f"{name:<18} {streams} streams in {wall:.2f}s - bot {bot_cpu / streams:.3f}s/stream, ffmpeg {ffmpeg_cpu / streams:.3f}s/stream, "
+          f"{(bot_cpu + ffmpeg_cpu) / audio_minutes:.3f} CPU s per audio minute")
+
+
+def main():
+    path = sys.argv[1]
+    streams = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    measure("pcm", lambda: play_pcm(path), streams)
+    measure("opus (encoded)", lambda: play_opus(path, .5), streams)
+    if path.endswith(('.webm', '.opus', '.ogg')):
+        measure("opus (passthrough)", lambda: play_opus(path, 1, 'opus'), streams)
+
+
+if __name__ == "__main__":
+    main()
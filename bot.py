@@ -1,31 +1,59 @@
+import time
+
+# Startup steps durations, logged on the first ready
+boot = time.perf_counter()
+startup = {}
+
+import asyncio
+import atexit
 import logging
 import os
+import queue
 import sys
 import traceback
-from logging.handlers import SysLogHandler
+from logging.handlers import SysLogHandler, QueueListener
 
 import django
 from dotenv import load_dotenv
 
+from utils.log_util import DeferredQueueHandler
 from utils.translate import _
 
-logging.basicConfig(level=logging.INFO)
 load_dotenv()
 
+# The handlers doing I/O run in the listener thread, logging from the event loop only enqueues the record.
+console = logging.StreamHandler()
+console.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
 syslog = SysLogHandler(address=(os.getenv("PAPERTRAIL_HOST"), int(os.getenv("PAPERTRAIL_PORT"))))
 format = '%(asctime)s LEGENDARYBOT: %(levelname)s %(message)s'
 formatter = logging.Formatter(format, datefmt='%b %d %H:%M:%S')
 syslog.setFormatter(formatter)
-logging.getLogger().addHandler(syslog)
+log_queue = queue.Queue()
+log_listener = QueueListener(log_queue, console, syslog, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+logging.getLogger().addHandler(DeferredQueueHandler(log_queue))
 logging.getLogger().setLevel(logging.INFO)
 
 os.environ['DJANGO_SETTINGS_MODULE']='legendarybot.settings'
+step = time.perf_counter()
+startup["imports"] = step - boot
 django.setup()
+startup["django_setup"] = time.perf_counter() - step
 
+step = time.perf_counter()
 from discord.ext import commands
-from lbwebsite.models import DiscordGuild
-
 
+from utils import battlenet_util, checks, db, http_util, response_cache, roster_cache, tracing
+from utils.cluster import ClusterClient
+from utils.custom_command_index import CustomCommandIndex
+from utils.guild_config import GuildConfigCache
+from utils.loop_monitor import LoopMonitor
+from utils.member_index import MemberIndex
+from utils.metrics import metrics
+from utils.prefix_cache import PrefixCache
+from utils.snapshot import Snapshot, SNAPSHOT_PATH
+startup["imports"] += time.perf_counter() - step
 
 
 initial_extensions = {
@@ -42,37 +70,140 @@ initial_extensions = {
 }
 
 
-def _prefix_callable(bot, msg):
+# Members are only cached in full for the guilds needing them, see RankSystem.ensure_members
+FETCH_OFFLINE_MEMBERS = os.getenv("FETCH_OFFLINE_MEMBERS", "false").lower() == "true"
+
+
+async def _prefix_callable(bot, msg):
     user_id = bot.user.id
     base = [f'<@!{user_id}> ', f'<@{user_id}> ']
     if msg.guild is None:
         base.append("!")
-    try:
-        if msg.guild:
-            guild = DiscordGuild.objects.get(pk=msg.guild.id)
-            for prefix in guild.guildprefix_set.all():
-                base.append(prefix.prefix)
-            if base.__len__() == 2:
-                base.append("!")
-    except DiscordGuild.DoesNotExist:
-        base.append("!")
+    else:
+        prefixes = await bot.prefix_cache.get(msg.guild.id)
+        if prefixes:
+            base.extend(prefixes)
+        else:
+            base.append("!")
     return base
 
 
 
 class LegendaryBotDiscord(commands.AutoShardedBot):
 
-    def __init__(self):
-        super().__init__(command_prefix=_prefix_callable, pm_help=True)
+    def __init__(self, cluster_id=None, **kwargs):
+        super().__init__(command_prefix=_prefix_callable, pm_help=True, fetch_offline_members=FETCH_OFFLINE_MEMBERS, **kwargs)
+        self.cluster = ClusterClient(self, cluster_id)
+        self.cluster.start()
+        self.prefix_cache = PrefixCache()
+        self.guild_configs = GuildConfigCache(self)
+        self.custom_command_index = CustomCommandIndex()
+        self.member_index = MemberIndex()
+        self.http.request = self._traced_request(self.http.request)
+        self.loop_monitor = LoopMonitor(self.loop)
+        self.loop_monitor.start()
+        self.extension_timings = {}
+        step = time.perf_counter()
         for cog in initial_extensions:
             logging.info(f"Loading {cog}")
+            cog_start = time.perf_counter()
             self.load_extension(cog)
+            self.extension_timings[cog] = time.perf_counter() - cog_start
+        startup["extension_load"] = time.perf_counter() - step
+        # Restored before the gateway connects, the first events are served from warm caches
+        step = time.perf_counter()
+        self.snapshot = Snapshot({
+            "battlenet_tokens": battlenet_util,
+            "prefixes": self.prefix_cache,
+            "guild_configs": self.guild_configs,
+            "rosters": roster_cache.rosters,
+            "responses": response_cache.cache
+        }, path=SNAPSHOT_PATH if cluster_id is None else f"{SNAPSHOT_PATH}.{cluster_id}")
+        self.snapshot.restore()
+        self.snapshot.start(self.loop)
+        startup["snapshot_restore"] = time.perf_counter() - step
+
+    def _traced_request(self, request):
+        """Count the time spent calling the Discord API in the trace of the running command."""
+        async def traced_request(route, **kwargs):
+            with tracing.timed("discord"):
+                return await request(route, **kwargs)
+        return traced_request
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        trace = tracing.CommandTrace(ctx.command.qualified_name, ctx.guild.id if ctx.guild else None)
+        token = tracing.current_trace.set(trace)
+        try:
+            await super().invoke(ctx)
+        finally:
+            tracing.current_trace.reset(token)
+            trace.finish(ctx.command_failed)
+
+    async def start(self, *args, **kwargs):
+        self.gateway_start = time.perf_counter()
+        self.loop.create_task(self.warm_static()).add_done_callback(log_task_failure)
+        await super().start(*args, **kwargs)
+
+    async def warm_static(self):
+        """Load the data shared by every guild and the configuration of our configured guilds while the shards identify."""
+        step = time.perf_counter()
+        rank_system = self.get_cog("RankSystem")
+        if rank_system and rank_system.connected_realms is None:
+            await rank_system.load_connected_realms()
+        # The guilds are not known before the shards are ready, every configured guild of our shards is loaded
+        guild_ids = [guild_id for guild_id in await db.get_configured_guilds() if self.is_own_guild(guild_id)]
+        await asyncio.gather(self.prefix_cache.warm(guild_ids), self.guild_configs.warm(guild_ids))
+        logging.info(f"Caches warmed in {time.perf_counter() - step:.3f}s: {len(guild_ids)} configured guilds")
+
+    def is_own_guild(self, guild_id):
+        """Whether the guild belongs to one of the shards run by this process."""
+        return self.shard_ids is None or (int(guild_id) >> 22) % self.shard_count in self.shard_ids
 
     async def on_ready(self):
         logging.info(f"Logged in as {self.user.name} - {self.user.id}")
+        self.member_index.rebuild(self.guilds)
+        if "first_ready" not in startup:
+            startup["gateway"] = time.perf_counter() - self.gateway_start
+            startup["first_ready"] = time.perf_counter() - boot
+            slowest = sorted(self.extension_timings.items(), key=lambda item: item[1], reverse=True)[:3]
+            logging.info("Startup timings: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in startup.items())
+                         + ". Slowest extensions: " + ", ".join(f"{cog} {seconds:.3f}s" for cog, seconds in slowest))
+            metrics.point("legendarybot_startup", dict(startup))
+
+    async def close(self):
+        self.loop_monitor.stop()
+        await self.cluster.close()
+        await self.snapshot.close()
+        await battlenet_util.close()
+        await http_util.close()
+        await super().close()
+
+    async def on_guild_remove(self, guild):
+        self.prefix_cache.invalidate(guild.id)
+        self.guild_configs.invalidate(guild.id)
+        self.custom_command_index.invalidate(guild.id)
+        self.member_index.remove_guild(guild)
+
+    async def on_guild_join(self, guild):
+        self.member_index.add_guild(guild)
+
+    async def on_guild_available(self, guild):
+        self.member_index.add_guild(guild)
+
+    async def on_guild_unavailable(self, guild):
+        self.member_index.remove_guild(guild)
+
+    async def on_member_join(self, member):
+        self.member_index.add(member.id, member.guild.id)
+
+    async def on_member_remove(self, member):
+        self.member_index.remove(member.id, member.guild.id)
 
     async def on_command(self, ctx):
         self.get_cog("Stats").command_count += 1
+        metrics.increment("legendarybot_commands", command=ctx.command.qualified_name)
 
     async def on_command_error(self, ctx, error):
         if isinstance(error, commands.NoPrivateMessage):
@@ -81,10 +212,28 @@ class LegendaryBotDiscord(commands.AutoShardedBot):
             await ctx.author.send(_('Sorry. This command is disabled and cannot be used.'))
         elif isinstance(error, commands.BadArgument) or isinstance(error, commands.MissingRequiredArgument):
             await ctx.author.send(error)
+        elif isinstance(error, checks.CommandRefused):
+            await ctx.send(error)
         else:
             exc_type, exc_value, exc_traceback = sys.exc_info()
             traceback.print_exception(exc_type, error, exc_traceback)
 
-# Loading the bot
-client = LegendaryBotDiscord()
-client.run(os.getenv("BOT_TOKEN"))
+
+def log_task_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Background task failed", exc_info=task.exception())
+
+
+def main():
+    # Set by launcher.py when the bot runs as one cluster among others
+    kwargs = {}
+    if os.getenv("SHARD_IDS"):
+        kwargs["shard_ids"] = [int(shard_id) for shard_id in os.getenv("SHARD_IDS").split(",")]
+        kwargs["shard_count"] = int(os.getenv("SHARD_COUNT"))
+    cluster_id = os.getenv("CLUSTER_ID")
+    client = LegendaryBotDiscord(cluster_id=int(cluster_id) if cluster_id is not None else None, **kwargs)
+    client.run(os.getenv("BOT_TOKEN"))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@ import asyncio
 import logging
 import os
 
-import dbl
 from discord.ext.commands import Cog
 
 
@@ -12,17 +11,23 @@ class DiscordBotsOrgAPI(Cog):
     def __init__(self, bot):
         self.bot = bot
         self.token = os.getenv('DISCORDBOTSORG_TOKEN') #  set this to your DBL token
-        self.dblpy = dbl.Client(self.bot, self.token)
-        self.bot.loop.create_task(self.update_stats())
+        self.dblpy = None
+        # Every cluster would overwrite the count of the others, the primary one posts the total
+        if self.bot.cluster.is_primary:
+            self.bot.loop.create_task(self.update_stats())
 
     async def update_stats(self):
         """This function runs every 30 minutes to automatically update your server count"""
-
+        await self.bot.wait_until_ready()
+        # Imported once the bot is up, it is not needed to connect
+        import dbl
+        self.dblpy = dbl.Client(self.bot, self.token)
         while True:
             logger.info('attempting to post server count')
             try:
-                await self.dblpy.post_server_count()
-                logger.info('posted server count ({})'.format(len(self.bot.guilds)))
+                totals = await self.bot.cluster.totals()
+                await self.dblpy.http.post_server_count(self.bot.user.id, totals["guild_count"], None, None)
+                logger.info('posted server count ({})'.format(totals["guild_count"]))
             except Exception as e:
                 logger.exception('Failed to post server count\n{}: {}'.format(type(e).__name__, e))
             await asyncio.sleep(1800)
@@ -1,9 +1,8 @@
 from discord import Embed, Colour
 from discord.ext import commands
 from discord.ext.commands import Cog
-from lbwebsite.models import GuildCustomCommand
 
-from utils import checks
+from utils import checks, db
 from utils.translate import _
 
 
@@ -24,9 +23,9 @@ class CustomCommands(Cog):
     async def on_command_error(self, ctx, error):
         if isinstance(error, commands.CommandNotFound):
             if ctx.guild:
-                custom_command = GuildCustomCommand.objects.filter(guild_id=ctx.guild.id, name=ctx.invoked_with).first()
+                custom_command = await self.bot.custom_command_index.get(ctx.guild.id, ctx.invoked_with)
                 if custom_command:
-                    await ctx.send(custom_command.value)
+                    await ctx.send(custom_command)
 
     @commands.group(name="commands", invoke_without_command=True)
     @commands.guild_only()
@@ -37,9 +36,9 @@ class CustomCommands(Cog):
         Example: You can create a !ping text command that will reply Pong!
         """
         embed = Embed(title=_("Custom commands for the {guild_name} server.").format(guild_name=ctx.guild.name), colour=Colour.blurple())
-        custom_commands = GuildCustomCommand.objects.filter(guild_id=ctx.guild.id).all()
+        custom_commands = await self.bot.custom_command_index.get_all(ctx.guild.id)
         if custom_commands:
-            embed.description = '\n'.join(f'{command.name}' for command in custom_commands)
+            embed.description = '\n'.join(custom_commands)
         else:
             embed.description = _('No custom commands!')
         await ctx.message.author.send(embed=embed)
@@ -56,17 +55,14 @@ class CustomCommands(Cog):
         - The legendarybot-admin role.
         - The Manage Server or the Administrator permission.
         """
-
-        custom_command = GuildCustomCommand.objects.filter(guild_id=ctx.guild.id, name=command_name).first()
-        if custom_command:
-            custom_command.type = GuildCustomCommand.TEXT
-            custom_command.value = " ".join(text)
-            custom_command.save()
-            await ctx.message.author.send(_("Command {command_name} updated!").format(command_name=command_name))
-        else:
-            custom_command = GuildCustomCommand(guild_id=ctx.guild.id, name=command_name, type=GuildCustomCommand.TEXT, value=" ".join(text))
-            custom_command.save()
+        value = " ".join(text)
+        created = await db.set_custom_command(ctx.guild.id, command_name, value)
+        self.bot.custom_command_index.put(ctx.guild.id, command_name, value)
+        self.bot.guild_configs.invalidate(ctx.guild.id)
+        if created:
             await ctx.message.author.send(_("Command {command_name} created!").format(command_name=command_name))
+        else:
+            await ctx.message.author.send(_("Command {command_name} updated!").format(command_name=command_name))
 
     @custom_commands.command(name="remove")
     @checks.is_bot_admin()
@@ -78,9 +74,9 @@ class CustomCommands(Cog):
         - The legendarybot-admin role.
         - The Manage Server or the Administrator permission.
         """
-        custom_command = GuildCustomCommand.objects.filter(guild_id=ctx.guild.id, name=command_name).first()
-        if custom_command:
-            custom_command.delete()
+        if await db.remove_custom_command(ctx.guild.id, command_name):
+            self.bot.custom_command_index.remove(ctx.guild.id, command_name)
+            self.bot.guild_configs.invalidate(ctx.guild.id)
             await ctx.message.author.send(_("Command {command_name} removed!").format(command_name=command_name))
         else:
             await ctx.message.author.send(_("Command {command_name} not found!").format(command_name=command_name))
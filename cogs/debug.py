@@ -6,14 +6,22 @@ class Debug(Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.bot.cluster.register("user_guilds", self.user_guilds)
+
+    async def user_guilds(self, user_id):
+        """Guilds of this cluster the user is a member of."""
+        guilds = (self.bot.get_guild(guild_id) for guild_id in self.bot.member_index.guilds_of(user_id))
+        return [[guild.id, guild.name] for guild in guilds if guild]
 
     @commands.is_owner()
     @commands.command()
     async def debuguser(self, ctx, user_id):
         output = "Member in the following guilds:\n"
-        for guild in self.bot.guilds:
-            if guild.get_member(int(user_id)):
-                output += f"{guild.id} - {guild.name}\n"
+        for guilds in await self.bot.cluster.broadcast("user_guilds", user_id=int(user_id)):
+            if not isinstance(guilds, list):
+                continue
+            for guild_id, guild_name in guilds:
+                output += f"{guild_id} - {guild_name}\n"
         await ctx.message.author.send(output)
 
 
@@ -1,9 +1,8 @@
 from discord import Embed, Colour
 from discord.ext import commands
 from discord.ext.commands import Cog
-from lbwebsite.models import GuildPrefix
 
-from utils import checks
+from utils import checks, db
 from utils.translate import _
 
 class Prefix(commands.Converter):
@@ -25,10 +24,10 @@ class Meta(Cog):
         """Manages the Guild's custom prefixes.
         If called without a subcommand, this will list the currently set prefixes.
         """
-        prefixes = GuildPrefix.objects.filter(guild_id=ctx.guild.id).all()
+        prefixes = (await self.bot.guild_configs.get(ctx.guild.id)).prefixes
         embed = Embed(title=_('LegendaryBot prefixes configured.'), colour=Colour.blurple())
         if prefixes:
-            embed.description = '\n'.join(f'{prefix.prefix}' for prefix in prefixes)
+            embed.description = '\n'.join(prefixes)
         else:
             embed.description = _("No prefixes set.")
         await ctx.message.author.send(embed=embed)
@@ -46,10 +45,9 @@ class Meta(Cog):
         - The legendarybot-admin role.
         - The Manage Server or the Administrator permission.
         """
-        prefix_entry = GuildPrefix.objects.filter(guild_id=ctx.guild.id, prefix=prefix).first()
-        if not prefix_entry:
-            prefix_entry = GuildPrefix(guild_id=ctx.guild.id, prefix=prefix)
-            prefix_entry.save()
+        if await db.add_guild_prefix(ctx.guild.id, prefix):
+            self.bot.prefix_cache.add(ctx.guild.id, prefix)
+            self.bot.guild_configs.invalidate(ctx.guild.id)
             await ctx.send(_("Prefix {prefix} added to the server.").format(prefix=prefix))
         else:
             await ctx.send(_("Prefix {prefix} not set. Already existing.").format(prefix=prefix))
@@ -65,9 +63,9 @@ class Meta(Cog):
         - The legendarybot-admin role.
         - The Manage Server or the Administrator permission.
         """
-        prefix_entry = GuildPrefix.objects.filter(guild_id=ctx.guild.id, prefix=prefix).first()
-        if prefix_entry:
-            prefix_entry.delete()
+        if await db.remove_guild_prefix(ctx.guild.id, prefix):
+            self.bot.prefix_cache.remove(ctx.guild.id, prefix)
+            self.bot.guild_configs.invalidate(ctx.guild.id)
             await ctx.send(_("Prefix {prefix} removed from the server").format(prefix=prefix))
         else:
             await ctx.send(_("Prefix {prefix} does not exist.").format(prefix=prefix))
@@ -1,20 +1,24 @@
-
-# Suppress noise about console usage from errors
 import asyncio
 import itertools
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from urllib.parse import urlsplit, parse_qs
 
 import discord
-import youtube_dl as youtube_dl
 from async_timeout import timeout
 from discord.ext import commands
 from discord.ext.commands import Cog
 
+from utils import checks, ogg
+from utils.extraction_cache import extractions
 from utils.translate import _
 
-youtube_dl.utils.bug_reports_message = lambda: ''
-
-
 ytdl_format_options = {
     'format': 'bestaudio',
     'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
@@ -33,7 +37,97 @@ ffmpeg_options = {
     #'options': '-vn'
 }
 
-ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+# The opus path lets ffmpeg apply the volume and encode, or copy streams already in Opus.
+# The pcm path decodes every stream and scales the volume in Python, but can change it mid song.
+# The pcm path is also used when ffmpeg is built without libopus.
+AUDIO_PATH = os.getenv("MUSIC_AUDIO_PATH", "opus")
+# At 100% the Opus streams of YouTube are copied as they are, any other volume needs ffmpeg to encode
+DEFAULT_VOLUME = float(os.getenv("MUSIC_DEFAULT_VOLUME", .5))
+
+# Maximum number of voice channels the process plays in at the same time
+MAX_VOICE_SESSIONS = int(os.getenv("MAX_VOICE_SESSIONS", 100))
+# How often players whose voice client went away are looked for
+SUPERVISOR_INTERVAL = 60
+
+# Maximum number of songs queued from a single playlist
+MAX_PLAYLIST_SIZE = int(os.getenv("MAX_PLAYLIST_SIZE", 250))
+
+__ytdl = {}
+
+# Extractions block for seconds, they get their own pool so a burst of requests cannot starve the default executor.
+ytdl_executor = ThreadPoolExecutor(max_workers=int(os.getenv("YTDL_WORKERS", 2)), thread_name_prefix="ytdl")
+
+# Number of songs at the front of the queue having their stream resolved ahead of time
+PREFETCH_COUNT = 2
+# Lifetime of a stream URL not telling when it expires
+STREAM_URL_TTL = 60*60
+# A stream URL must stay valid for the duration of the song plus this margin to be used
+STREAM_URL_MARGIN = 10*60
+
+
+def get_ytdl(flat=False):
+    """youtube_dl is slow to import, it is only loaded when the first song is requested."""
+    if flat not in __ytdl:
+        import youtube_dl
+        # Suppress noise about console usage from errors
+        youtube_dl.utils.bug_reports_message = lambda: ''
+        if flat:
+            # Flat extraction only lists the videos of a playlist, each one is extracted when it nears the front of the queue
+            __ytdl[flat] = youtube_dl.YoutubeDL({**ytdl_format_options, 'noplaylist': False, 'extract_flat': 'in_playlist',
+                                                 'playlistend': MAX_PLAYLIST_SIZE})
+        else:
+            __ytdl[flat] = youtube_dl.YoutubeDL(ytdl_format_options)
+    return __ytdl[flat]
+
+
+def _extract(query, download=False, flat=False):
+    return get_ytdl(flat).extract_info(query, download=download)
+
+
+__opus_supported = None
+
+
+def opus_supported():
+    """Whether ffmpeg can encode Opus, checked once."""
+    global __opus_supported
+    if __opus_supported is None:
+        try:
+            encoders = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10).stdout
+            __opus_supported = b'libopus' in encoders
+        except (OSError, subprocess.SubprocessError):
+            __opus_supported = False
+        if not __opus_supported:
+            logging.warning("ffmpeg cannot encode Opus, music is played through the PCM path")
+    return __opus_supported
+
+
+def stream_expires_at(stream_url):
+    expire = parse_qs(urlsplit(stream_url).query).get('expire')
+    if expire:
+        return int(expire[0])
+    return time.time() + STREAM_URL_TTL
+
+
+def is_playlist(query):
+    parts = urlsplit(query.strip())
+    if parts.scheme not in ('http', 'https'):
+        return False
+    params = parse_qs(parts.query)
+    return parts.path == '/playlist' or ('list' in params and 'v' not in params) or '/sets/' in parts.path
+
+
+async def extract_info(query, *, loop):
+    """Extract a track and return it as a queue entry, the result is kept in the extraction cache."""
+    to_run = partial(_extract, query)
+    data = await loop.run_in_executor(ytdl_executor, to_run)
+    if 'entries' in data:
+        # take first item from a playlist
+        data = data['entries'][0]
+    metadata = {'webpage_url': data['webpage_url'], 'title': data['title'], 'duration': data.get('duration'),
+                'codec': data.get('acodec')}
+    expires_at = stream_expires_at(data['url'])
+    extractions.store(query, metadata, data['url'], expires_at)
+    return dict(metadata, stream_url=data['url'], expires_at=expires_at)
 
 
 class YTDLSource(discord.PCMVolumeTransformer):
@@ -58,8 +152,19 @@ class YTDLSource(discord.PCMVolumeTransformer):
     async def create_source(cls, ctx, search: str, *, loop, download=False):
         loop = loop or asyncio.get_event_loop()
 
-        to_run = partial(ytdl.extract_info, url=search, download=download)
-        data = await loop.run_in_executor(None, to_run)
+        if not download:
+            entry = extractions.lookup(search)
+            if entry is None:
+                entry = await extract_info(search, loop=loop)
+            elif not cls.stream_is_valid(entry):
+                # Known track, extracting its page directly skips the search
+                entry = await extract_info(entry['webpage_url'], loop=loop)
+            entry['requester'] = ctx.author
+            await ctx.send(_('```ini\n[Added {song_title} to the Queue.]\n```').format(song_title=entry["title"]), delete_after=15)
+            return entry
+
+        to_run = partial(_extract, search, download=download)
+        data = await loop.run_in_executor(ytdl_executor, to_run)
 
         if 'entries' in data:
             # take first item from a playlist
@@ -67,28 +172,120 @@ class YTDLSource(discord.PCMVolumeTransformer):
 
         await ctx.send(_('```ini\n[Added {song_title} to the Queue.]\n```').format(song_title=data["title"]), delete_after=15)
 
-        if download:
-            source = ytdl.prepare_filename(data)
-        else:
-            return {'webpage_url': data['webpage_url'], 'requester': ctx.author, 'title': data['title']}
-
+        source = get_ytdl().prepare_filename(data)
         return cls(discord.FFmpegPCMAudio(source), data=data, requester=ctx.author)
 
     @classmethod
-    async def regather_stream(cls, data, *, loop):
+    async def create_playlist(cls, ctx, url: str, *, loop):
+        """Queue entries of the songs of a playlist. They only hold what the flat extraction gives, the stream is resolved later."""
+        loop = loop or asyncio.get_event_loop()
+
+        to_run = partial(_extract, url, flat=True)
+        data = await loop.run_in_executor(ytdl_executor, to_run)
+
+        entries = []
+        for entry in itertools.islice(data.get('entries') or [], 0, MAX_PLAYLIST_SIZE):
+            if entry.get('ie_key') == 'Youtube':
+                webpage_url = f"https://www.youtube.com/watch?v={entry['id']}"
+            else:
+                webpage_url = entry.get('webpage_url') or entry.get('url')
+            if webpage_url:
+                entries.append({'webpage_url': webpage_url, 'requester': ctx.author,
+                                'title': entry.get('title') or webpage_url, 'duration': entry.get('duration')})
+
+        await ctx.send(_('```ini\n[Added {count} songs from {playlist} to the Queue.]\n```').format(count=len(entries), playlist=data.get('title')), delete_after=15)
+        return entries
+
+    @staticmethod
+    def stream_is_valid(data):
+        if 'stream_url' not in data:
+            return False
+        return data['expires_at'] - time.time() > (data.get('duration') or 0) + STREAM_URL_MARGIN
+
+    @classmethod
+    async def resolve(cls, data, *, loop):
+        """Make sure the queue entry holds a stream URL valid long enough to play it."""
+        if cls.stream_is_valid(data):
+            return
+        stream = extractions.stream(data['webpage_url'])
+        if stream is not None:
+            data['stream_url'], data['expires_at'] = stream
+            if cls.stream_is_valid(data):
+                return
+        data.update(await extract_info(data['webpage_url'], loop=loop))
+
+    @classmethod
+    async def regather_stream(cls, data, *, loop, volume=DEFAULT_VOLUME):
         """Used for preparing a stream, instead of downloading.
         Since Youtube Streaming links expire."""
         loop = loop or asyncio.get_event_loop()
-        requester = data['requester']
+        prefetch = data.pop('prefetch', None)
+        if prefetch is not None:
+            try:
+                await prefetch
+            except Exception:
+                pass
+        await cls.resolve(data, loop=loop)
+        if AUDIO_PATH == "opus" and await loop.run_in_executor(None, opus_supported):
+            return YTDLOpusSource(data['stream_url'], data=data, requester=data['requester'], volume=volume)
+        source = cls(discord.FFmpegPCMAudio(data['stream_url']), data=data, requester=data['requester'])
+        source.volume = volume
+        return source
+
+
+class YTDLOpusSource(discord.AudioSource):
+    """
+    Opus stream of a song, the bot only forwards the packets ffmpeg gives it.
+    The volume is applied by ffmpeg when the song starts, at 100% Opus streams are copied without being decoded.
+    discord.py 1.3 has no FFmpegOpusAudio, ffmpeg writes an Ogg stream the packets are taken from.
+    """
+
+    def __init__(self, source, *, data, requester, volume, executable='ffmpeg', before_options=None, bitrate=128):
+        self.requester = requester
+        self.volume = volume
 
-        to_run = partial(ytdl.extract_info, url=data['webpage_url'], download=False)
-        data = await loop.run_in_executor(None, to_run)
-        return cls(discord.FFmpegPCMAudio(data['url']), data=data, requester=requester)
+        self.title = data.get('title')
+        self.web_url = data.get('webpage_url')
+        self.duration = data.get("duration")
+
+        if volume == 1 and data.get('codec') == 'opus':
+            codec, filters = 'copy', []
+        else:
+            codec, filters = 'libopus', ['-filter:a', f'volume={volume:.2f}']
+        args = [executable]
+        if before_options:
+            args.extend(shlex.split(before_options))
+        args.extend(['-i', source, '-vn', *filters, '-map_metadata', '-1', '-f', 'opus', '-c:a', codec,
+                     '-ar', '48000', '-ac', '2', '-b:a', f'{bitrate}k', '-loglevel', 'warning', 'pipe:1'])
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+        try:
+            self._process = subprocess.Popen(args, stdout=subprocess.PIPE, creationflags=creationflags)
+        except FileNotFoundError:
+            raise discord.ClientException(executable + ' was not found.') from None
+        self._packets = ogg.iter_opus_packets(self._process.stdout)
+
+    def __getitem__(self, item: str):
+        return self.__getattribute__(item)
+
+    def is_opus(self):
+        return True
+
+    def read(self):
+        return next(self._packets, b'')
+
+    def cleanup(self):
+        process = self._process
+        if process is None:
+            return
+        process.kill()
+        if process.poll() is None:
+            process.communicate()
+        self._process = None
 
 
 class MusicPlayer:
 
-    __slots__ = ('bot', '_guild', '_channel', '_cog', 'queue', 'volume', 'current', 'next')
+    __slots__ = ('bot', '_guild', '_channel', '_cog', 'queue', 'volume', 'current', 'next', 'task')
 
     def __init__(self, ctx):
         self.bot = ctx.bot
@@ -98,9 +295,9 @@ class MusicPlayer:
         self.queue = asyncio.Queue()
         self.next = asyncio.Event()
 
-        self.volume = .5
+        self.volume = DEFAULT_VOLUME
         self.current = None
-        ctx.bot.loop.create_task(self.player_loop())
+        self.task = ctx.bot.loop.create_task(self.player_loop())
 
     async def player_loop(self):
         await self.bot.wait_until_ready()
@@ -115,14 +312,15 @@ class MusicPlayer:
             except asyncio.TimeoutError:
                 return self.destroy(self._guild)
 
-            if not isinstance(source, YTDLSource):
+            if isinstance(source, dict):
                 # Source was probably a stream (not downloaded)
                 # So we should regather to prevent stream expiration
                 try:
-                    source = await YTDLSource.regather_stream(source, loop=self.bot.loop)
+                    source = await YTDLSource.regather_stream(source, loop=self.bot.loop, volume=self.volume)
                 except Exception as e:
                     await self._channel.send(_('There was an error processing your song.') + f"\n```css\n[{e}]\n```" )
                     continue
+            self.prefetch()
             #Set the volume to current value
             source.volume = self.volume
 
@@ -136,6 +334,29 @@ class MusicPlayer:
             source.cleanup()
             self.current = None
 
+    def prefetch(self):
+        """Resolve the stream of the next songs in the queue while the current one plays."""
+        for entry in itertools.islice(self.queue._queue, 0, PREFETCH_COUNT):
+            if isinstance(entry, dict) and 'prefetch' not in entry:
+                entry['prefetch'] = self.bot.loop.create_task(YTDLSource.resolve(entry, loop=self.bot.loop))
+                # Errors are handled when the song comes up, do not let asyncio complain about them
+                entry['prefetch'].add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    def ffmpeg_running(self):
+        process = getattr(getattr(self.current, 'original', self.current), '_process', None)
+        return process is not None and process.poll() is None
+
+    def close(self):
+        """Stop the player loop, kill ffmpeg and drop the queued songs."""
+        self.task.cancel()
+        if self.current is not None:
+            self.current.cleanup()
+            self.current = None
+        while not self.queue.empty():
+            entry = self.queue.get_nowait()
+            if isinstance(entry, dict) and 'prefetch' in entry:
+                entry['prefetch'].cancel()
+
     def destroy(self, guild):
         """Disconnect and cleanup the player."""
         return self.bot.loop.create_task(self._cog.cleanup(guild))
@@ -144,6 +365,40 @@ class Music(Cog):
     def __init__(self, bot):
         self.bot = bot
         self.players = {}
+        self.reclaimed = 0
+        # Guild IDs whose voice client was gone at the last check, a reconnecting voice client is briefly disconnected
+        self.suspects = set()
+        self.supervisor = self.bot.loop.create_task(self.supervise())
+
+    def cog_unload(self):
+        self.supervisor.cancel()
+        for player in self.players.values():
+            player.close()
+        self.players.clear()
+
+    async def supervise(self):
+        """Reclaim the players whose voice client went away without going through cleanup."""
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            await asyncio.sleep(SUPERVISOR_INTERVAL)
+            suspects, self.suspects = self.suspects, set()
+            for guild_id, player in list(self.players.items()):
+                voice_client = player._guild.voice_client
+                if self.bot.get_guild(guild_id) is None or voice_client is None or not voice_client.is_connected():
+                    if guild_id not in suspects:
+                        self.suspects.add(guild_id)
+                        continue
+                    self.reclaimed += 1
+                    await self.cleanup(player._guild)
+
+    def stats(self):
+        return {
+            "music_players": len(self.players),
+            "music_voice_sessions": len(self.bot.voice_clients),
+            "music_ffmpeg_processes": sum(1 for player in self.players.values() if player.ffmpeg_running()),
+            "music_queued_songs": sum(player.queue.qsize() for player in self.players.values()),
+            "music_players_reclaimed": self.reclaimed
+        }
 
     def get_player(self, ctx):
         """Retrieve the guild player, or generate one."""
@@ -161,22 +416,29 @@ class Music(Cog):
         except AttributeError:
             pass
 
-        try:
-            del self.players[guild.id]
-        except KeyError:
-            pass
+        player = self.players.pop(guild.id, None)
+        if player is not None:
+            player.close()
 
     @commands.command()
     async def playmusic(self, ctx, *, url):
-        """Play a song"""
+        """Play a song or a playlist"""
         state = self.get_player(ctx)
         async with ctx.typing():
-            player = await YTDLSource.create_source(ctx, url, loop=self.bot.loop, download=False)
-            await state.queue.put(player)
+            if is_playlist(url):
+                for entry in await YTDLSource.create_playlist(ctx, url, loop=self.bot.loop):
+                    state.queue.put_nowait(entry)
+            else:
+                player = await YTDLSource.create_source(ctx, url, loop=self.bot.loop, download=False)
+                await state.queue.put(player)
+            state.prefetch()
 
     @commands.command()
     async def volume(self, ctx, volume: int):
-        """Changes the player's volume"""
+        """
+        Changes the player's volume
+        The new volume may only apply from the next song.
+        """
 
         if volume < 0 or volume > 100:
             raise commands.CommandError(_("The minimum volume is 0 and the maximum is 100."))
@@ -184,11 +446,14 @@ class Music(Cog):
             return await ctx.send(_("Not connected to a voice channel."))
 
         player = self.get_player(ctx)
+        player.volume = volume / 100
+
+        if isinstance(player.current, YTDLOpusSource):
+            # ffmpeg is already encoding the song with the old volume
+            return await ctx.send(_("Changed volume to {volume}%, it will apply from the next song.").format(volume=volume), delete_after=20)
         if player.current:
             player.current.volume = volume / 100
 
-        player.volume = volume / 100
-
         await ctx.send(_("Changed volume to {volume}%").format(volume=volume), delete_after=20)
 
     @commands.command()
@@ -275,11 +540,12 @@ class Music(Cog):
     @playmusic.before_invoke
     async def ensure_voice(self, ctx):
         if ctx.voice_client is None:
+            if len(self.bot.voice_clients) >= MAX_VOICE_SESSIONS:
+                raise checks.CommandRefused(_("Too many servers are listening to music right now, try again later."))
             if ctx.author.voice:
                 await ctx.author.voice.channel.connect()
             else:
-                await ctx.send(_("You are not connected to a voice channel."))
-                raise commands.CommandError(_("Author not connected to a voice channel."))
+                raise checks.CommandRefused(_("You are not connected to a voice channel."))
 
 def setup(bot):
     bot.add_cog(Music(bot))
\ No newline at end of file
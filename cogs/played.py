@@ -9,16 +9,18 @@ class Played(Cog):
     def __init__(self, bot):
         self.timer = 60
         self.bot = bot
+        self.task = self.bot.loop.create_task(self.background_task())
+
+    def cog_unload(self):
+        self.task.cancel()
 
     async def background_task(self):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
-            await self.bot.change_presence(activity=Game(f"on {len(self.bot.guilds)} servers"))
+            totals = await self.bot.cluster.totals()
+            await self.bot.change_presence(activity=Game(f"on {totals['guild_count']} servers"))
             await asyncio.sleep(self.timer)
 
-    async def on_ready(self):
-        self.bot.loop.create_task(self.background_task())
-
 
 def setup(bot):
     bot.add_cog(Played(bot))
\ No newline at end of file
@@ -1,12 +1,14 @@
 import asyncio
 import logging
+import os
+import time
 
 from discord.ext import commands
 from discord.ext.commands import Cog
-from lbwebsite.models import GuildSetting, Character, GuildRank, RealmConnected
-from social_django.models import UserSocialAuth
 
-from utils import battlenet_util
+from utils import db, roster_cache
+from utils.log_util import RateLimitFilter
+from utils.rate_limit import TokenBucket
 from utils.translate import _
 
 
@@ -15,39 +17,44 @@ class RankSystem(Cog):
     def __init__(self, bot):
         self.timer = 1800
         self.bot = bot
+        # Discord guild ID -> {member ID: (main character, discord rank, role IDs)} as of the last sync
+        self.member_snapshots = {}
+        self.guild_fingerprints = {}
+        # Discord guild ID -> (members examined, members modified) of the last sync
+        self.sync_results = {}
+        # (server slug, region) -> connected realm slugs
+        self.connected_realms = None
+        self.sync_semaphore = asyncio.Semaphore(int(os.getenv("RANK_SYNC_CONCURRENCY", 4)))
+        self.sync_task = None
+        # Discord guild IDs with a sync queued or running
+        self.syncing = set()
+        self.queue_depth = 0
+        self.running_syncs = 0
+        # Discord guild ID -> time of the last finished sync / duration in seconds of the last sync
+        self.last_sync = {}
+        self.sync_durations = {}
+        # Discord rate limits role edits per guild, the global bucket keeps us under the global rate limit.
+        self.role_edit_bucket = TokenBucket(rate=20, capacity=20)
+        self.guild_role_edit_buckets = {}
 
-    def generate_member_rank_map(self, guild):
-        logging.info(f"{guild.guild.guild_id} - Generating the rank map")
-        guild_ranks = GuildRank.objects.filter(guild=guild.guild).all()
+    async def generate_member_rank_map(self, guild, guild_ranks):
+        """
+        Map every WoW guild binded in the rank settings, keyed by (region, realm, guild name),
+        to its rank bindings and its roster.
+        """
+        logger.debug("%s - Generating the rank map", guild.guild.guild_id)
         if guild_ranks:
-            #Retrieve from blizzard the information about members in the guilds
             guilds = {}
             #Loop through the ranks to get which's guilds to fetch from blizzard
             for guild_rank in guild_ranks:
-                region = guild_rank.wow_guild.get_region_display()
-                realm = guild_rank.wow_guild.server_slug
-                guild_name = guild_rank.wow_guild.guild_name
-                if region not in guilds:
-                    guilds[region] = {}
-                if realm not in guilds[region]:
-                    guilds[region][realm] = {}
-                if guild_name not in guilds[region][realm]:
-                    guilds[region][realm][guild_name] = {}
-                if 'ranks' not in guilds[region][realm][guild_name]:
-                    guilds[region][realm][guild_name]['ranks'] = {}
-                guilds[region][realm][guild_name]['ranks'][guild_rank.rank_id] = guild_rank.discord_rank
-            logging.info(f"{guild.guild.guild_id} - Mapped the following from the config: {guilds}")
-            for region in guilds:
-                for realm in guilds[region]:
-                    for guild_name in guilds[region][realm]:
-                        bnet_request = battlenet_util.execute_battlenet_request(f"https://{region}.api.blizzard.com/wow/guild/{realm}/{guild_name}", params={"fields": "members"})
-                        if bnet_request.ok:
-                            bnet_json = bnet_request.json()
-                            guilds[region][realm][guild_name]["members"] = {}
-                            for member in bnet_json['members']:
-                                if member['character']['realm'].lower() not in guilds[region][realm][guild_name]["members"]:
-                                    guilds[region][realm][guild_name]["members"][member['character']['realm'].lower()] = {}
-                                guilds[region][realm][guild_name]["members"][member['character']['realm'].lower()][member['character']['name']] = member['rank']
+                key = (guild_rank.wow_guild.get_region_display(), guild_rank.wow_guild.server_slug, guild_rank.wow_guild.guild_name)
+                guilds.setdefault(key, {"ranks": {}, "roster": None})["ranks"][guild_rank.rank_id] = guild_rank.discord_rank
+            logger.debug("%s - Mapped the following from the config: %s", guild.guild.guild_id, guilds)
+            #Retrieve from blizzard the members of the guilds, shared with the other servers syncing the same guilds
+            wow_guilds = list(guilds.keys())
+            guild_rosters = await asyncio.gather(*[roster_cache.rosters.get(*key) for key in wow_guilds])
+            for key, roster in zip(wow_guilds, guild_rosters):
+                guilds[key]["roster"] = roster
             return guilds
         return None
 
@@ -60,87 +67,155 @@ class RankSystem(Cog):
             roles_list[role.name] = role
         return roles_list
 
-    def get_user_main_character(self, guild, member):
-        user_social = UserSocialAuth.objects.filter(provider='discord', uid=member.id).first()
-        if user_social:
-            character = Character.objects.filter(user=user_social.user, main_for_guild=guild.id).first()
-            if character:
-                return character
-        return None
+    async def get_user_main_character(self, guild, member):
+        return await db.get_main_character(guild.id, member.id)
+
+    async def load_connected_realms(self):
+        """Load the connected realm graph in memory, keyed by (server slug, region)."""
+        self.connected_realms = await db.get_connected_realms()
 
     def check_if_bot_can_update_rank(self, discord_guild):
         return discord_guild.me.top_role.permissions.manage_roles
 
-    async def update_user_rank(self, guilds, discord_guild, member):
-        roles_list = self.generate_discord_rank_map(discord_guild)
-        logging.info(f"{discord_guild.id} - Role list generated from Discord: {roles_list}")
-        bot_role = discord_guild.me.top_role
-        logging.info(f"{discord_guild.id} - The guild role for the bot is {bot_role}")
-        character = self.get_user_main_character(discord_guild, member)
-        logging.info(f"{discord_guild.id} - The member character {character}")
+    def character_key(self, character):
         if character:
-            #We have a main character. Let's find the member from the guild list
-            connected_realm = RealmConnected.objects.filter(server_slug=character.server_slug, region=character.region).first()
-            server_name = None
-            if character.server_slug in guilds[character.get_region_display()] and character.guild_name in guilds[character.get_region_display()][character.server_slug] and character.name in guilds[character.get_region_display()][character.server_slug][character.guild_name]["members"][character.server_slug]:
-                server_name = character.server_slug
-            else:
-                for realm_entry in connected_realm.connected_realm.all():
-                    if realm_entry.server_slug in guilds[character.get_region_display()] and character.guild_name in guilds[character.get_region_display()][realm_entry.server_slug] and character.name in guilds[character.get_region_display()][realm_entry.server_slug][character.guild_name]["members"][character.server_slug]:
-                        server_name = realm_entry.server_slug
-            if server_name:
-                #The user is found in the guild, let's get his rank ID
-                rank_id = guilds[character.get_region_display()][server_name][character.guild_name]["members"][character.server_slug][character.name]
-                discord_rank = guilds[character.get_region_display()][server_name][character.guild_name]['ranks'][rank_id]
-                logging.info(f"{discord_guild.id} - The character have the following rank {rank_id} which is binded to this rank in discord: {discord_rank}")
-                #Search if the role is found in Discord
-                if discord_rank in roles_list:
-                    #Role found, let's see if the bot can set it
-                    if roles_list[discord_rank] < bot_role:
-                        logging.info(f"{discord_guild.id} - The bot can set the role")
-                        #We can set it, remove all roles we can from the user and set this one.
-                        member_roles = member.roles
-                        roles_to_remove = []
-                        already_has_role = False
-                        #Loop through the current roles to see which role to remove and if we already have the wanted role
-                        for member_role in member_roles:
-                            if not member_role.is_default() and member_role < bot_role and member_role != roles_list[discord_rank]:
-                                roles_to_remove.append(member_role)
-                            if member_role == roles_list[discord_rank]:
-                                already_has_role = True
-                        if roles_to_remove:
-                            logging.info(f"{discord_guild.id}- Removing ranks for {member.name}-{member.id} {roles_to_remove}")
-                            await member.remove_roles(*roles_to_remove, reason="LegendaryBot WoW Sync")
-                        if not already_has_role:
-                            logging.info(f"{discord_guild.id} - Adding rank {roles_list[discord_rank]} to {member.name}-{member.id}")
-                            await member.add_roles(roles_list[discord_rank], reason="LegendaryBot WoW Sync")
+            return character.get_region_display(), character.server_slug, character.guild_name, character.name
+        return None
+
+    def find_discord_rank(self, guilds, character):
+        """
+        Find the Discord rank binded to the in-game rank of the character.
+        Returns None if the character is not in a configured guild or its rank is not binded.
+        """
+        region = character.get_region_display()
+        #The guild may be registered on a realm connected to the character's realm
+        realms = [character.server_slug] + self.connected_realms.get((character.server_slug, character.region), [])
+        for realm in realms:
+            wow_guild = guilds.get((region, realm, character.guild_name))
+            if wow_guild and wow_guild["roster"]:
+                rank_id = wow_guild["roster"].rank_of(character.server_slug, character.name)
+                if rank_id is not None:
+                    return wow_guild["ranks"].get(rank_id)
+        return None
+
+    async def update_user_rank(self, guilds, discord_guild, member, roles_list=None, discord_rank=None):
+        """
+        Set the Discord rank of the member to the one of his main character.
+        Returns the IDs of the roles the member has after the update.
+        """
+        if roles_list is None:
+            roles_list = self.generate_discord_rank_map(discord_guild)
+            logger.debug("%s - Role list generated from Discord: %s", discord_guild.id, roles_list)
+        bot_role = discord_guild.me.top_role
+        logger.debug("%s - The guild role for the bot is %s", discord_guild.id, bot_role)
+        member_role_ids = {role.id for role in member.roles}
+        if discord_rank is None:
+            character = await self.get_user_main_character(discord_guild, member)
+            logger.debug("%s - The member character %s", discord_guild.id, character)
+            if not character:
+                return member_role_ids
+            discord_rank = self.find_discord_rank(guilds, character)
+        if discord_rank:
+            logger.debug("%s - The character is binded to this rank in discord: %s", discord_guild.id, discord_rank)
+            #Search if the role is found in Discord
+            if discord_rank in roles_list:
+                #Role found, let's see if the bot can set it
+                if roles_list[discord_rank] < bot_role:
+                    logger.debug("%s - The bot can set the role", discord_guild.id)
+                    #We can set it, remove all roles we can from the user and set this one.
+                    member_roles = member.roles
+                    roles_to_remove = []
+                    already_has_role = False
+                    #Loop through the current roles to see which role to remove and if we already have the wanted role
+                    for member_role in member_roles:
+                        if not member_role.is_default() and member_role < bot_role and member_role != roles_list[discord_rank]:
+                            roles_to_remove.append(member_role)
+                        if member_role == roles_list[discord_rank]:
+                            already_has_role = True
+                    if roles_to_remove:
+                        logger.info("%s - Removing ranks for %s-%s %s", discord_guild.id, member.name, member.id, roles_to_remove)
+                        await self.wait_for_role_edit(discord_guild)
+                        await member.remove_roles(*roles_to_remove, reason="LegendaryBot WoW Sync")
+                        member_role_ids.difference_update(role.id for role in roles_to_remove)
+                    if not already_has_role:
+                        logger.info("%s - Adding rank %s to %s-%s", discord_guild.id, roles_list[discord_rank], member.name, member.id)
+                        await self.wait_for_role_edit(discord_guild)
+                        await member.add_roles(roles_list[discord_rank], reason="LegendaryBot WoW Sync")
+                        member_role_ids.add(roles_list[discord_rank].id)
+        return member_role_ids
+
+    async def wait_for_role_edit(self, discord_guild):
+        if discord_guild.id not in self.guild_role_edit_buckets:
+            self.guild_role_edit_buckets[discord_guild.id] = TokenBucket(rate=1, capacity=5)
+        await self.guild_role_edit_buckets[discord_guild.id].acquire()
+        await self.role_edit_bucket.acquire()
+
+    def guild_fingerprint(self, discord_guild, roles_list):
+        """Anything that changes which role a member should get without changing the member itself."""
+        return discord_guild.me.top_role.id, discord_guild.me.top_role.position, tuple(sorted((name, role.id, role.position) for name, role in roles_list.items()))
+
+    async def ensure_members(self, discord_guild):
+        """Offline members of large guilds are not cached at startup, they are requested before the first sync of the guild."""
+        if discord_guild.large and not discord_guild.chunked and not discord_guild.unavailable:
+            start = time.monotonic()
+            await self.bot.request_offline_members(discord_guild)
+            self.bot.member_index.add_guild(discord_guild)
+            logger.info("%s - Requested the offline members, %s members cached in %.3fs.", discord_guild.id, len(discord_guild.members), time.monotonic() - start)
 
     async def run_sync(self, guild):
         #Retrieve the Guild from Discord
-        logging.info(f"{guild.guild.guild_id} - Retrieving the Discord guild from Discord.")
+        logger.debug("%s - Retrieving the Discord guild from Discord.", guild.guild.guild_id)
         discord_guild = self.bot.get_guild(guild.guild.guild_id)
         if discord_guild:
             #Retrieve the rank settings for the guild
-            logging.info(f"{guild.guild.guild_id} - Retrieving guild ranks.")
-            guild_ranks = GuildRank.objects.filter(guild=guild.guild).all()
+            logger.debug("%s - Retrieving guild ranks.", guild.guild.guild_id)
+            guild_ranks = (await self.bot.guild_configs.get(guild.guild.guild_id)).ranks
             #Check if we have any ranks setup
             if guild_ranks:
-                logging.info(f"{guild.guild.guild_id} - Found {len(guild_ranks)} ranks.")
-                member_rank_map = self.generate_member_rank_map(guild)
-                logging.info(f"{guild.guild.guild_id} - The following map was generated {member_rank_map}")
+                logger.debug("%s - Found %s ranks.", guild.guild.guild_id, len(guild_ranks))
+                member_rank_map = await self.generate_member_rank_map(guild, guild_ranks)
+                if self.connected_realms is None:
+                    await self.load_connected_realms()
+                logger.debug("%s - The following map was generated %s", guild.guild.guild_id, member_rank_map)
                 #Retrieve LegendaryBot role and check if we can manage permissions
                 if self.check_if_bot_can_update_rank(discord_guild):
-                    logging.info(f"{guild.guild.guild_id} - The bot have permission to modify the ranks")
-                    #Retrieve he members
-                    members = discord_guild.members
-                    for member in members:
-                        await self.update_user_rank(member_rank_map, discord_guild, member)
+                    logger.debug("%s - The bot have permission to modify the ranks", guild.guild.guild_id)
+                    roles_list = self.generate_discord_rank_map(discord_guild)
+                    fingerprint = (self.guild_fingerprint(discord_guild, roles_list), tuple(sorted((rank.rank_id, rank.discord_rank) for rank in guild_ranks)))
+                    if self.guild_fingerprints.get(discord_guild.id) != fingerprint:
+                        self.member_snapshots[discord_guild.id] = {}
+                        self.guild_fingerprints[discord_guild.id] = fingerprint
+                    snapshot = self.member_snapshots[discord_guild.id]
+                    await self.ensure_members(discord_guild)
+                    main_characters = await db.get_main_characters(discord_guild.id)
+                    examined = 0
+                    modified = 0
+                    #Only touch the members whose main character, in-game rank or Discord roles changed since the last sync
+                    for member in discord_guild.members:
+                        examined += 1
+                        character = main_characters.get(member.id)
+                        discord_rank = self.find_discord_rank(member_rank_map, character) if character else None
+                        role_ids = frozenset(role.id for role in member.roles)
+                        if snapshot.get(member.id) == (self.character_key(character), discord_rank, role_ids):
+                            continue
+                        if discord_rank:
+                            new_role_ids = await self.update_user_rank(member_rank_map, discord_guild, member, roles_list, discord_rank)
+                            if new_role_ids != role_ids:
+                                modified += 1
+                                role_ids = frozenset(new_role_ids)
+                        snapshot[member.id] = (self.character_key(character), discord_rank, role_ids)
+                    for member_id in snapshot.keys() - {member.id for member in discord_guild.members}:
+                        del snapshot[member_id]
+                    self.sync_results[discord_guild.id] = (examined, modified)
+                    logger.info("%s - Rank sync done. %s members examined, %s modified.", guild.guild.guild_id, examined, modified)
 
     async def run_user_sync(self, discord_guild, discord_guild_setting, member):
-        guild_ranks = GuildRank.objects.filter(guild=discord_guild_setting.guild).all()
+        guild_ranks = (await self.bot.guild_configs.get(discord_guild.id)).ranks
         #Check if we have any ranks setup
         if guild_ranks:
-            member_rank_map = self.generate_member_rank_map(discord_guild_setting)
+            member_rank_map = await self.generate_member_rank_map(discord_guild_setting, guild_ranks)
+            if self.connected_realms is None:
+                await self.load_connected_realms()
             #Retrieve LegendaryBot role and check if we can manage permissions
             if self.check_if_bot_can_update_rank(discord_guild):
                 await self.update_user_rank(member_rank_map, discord_guild, member)
@@ -148,16 +223,65 @@ class RankSystem(Cog):
     async def background_task(self):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
-            logging.info("Starting Rank background task.")
+            logger.info("Starting Rank background task.")
             #We get all the guilds that have the rank system enabled
-            guildrank_enabled_guilds = GuildSetting.objects.filter(setting_name="rank_enabled_loop").all()
-            for guild in guildrank_enabled_guilds:
-                logging.info(f"Doing rank sync for guild {guild.guild.guild_id} - {guild.guild.name}")
-                await self.run_sync(guild)
+            guildrank_enabled_guilds = await db.get_guild_settings("rank_enabled_loop")
+            await self.load_connected_realms()
+            #The guilds that waited the longest since their last sync go first
+            guildrank_enabled_guilds.sort(key=lambda guild: self.last_sync.get(guild.guild.guild_id, 0))
+            await asyncio.gather(*[self.scheduled_sync(guild) for guild in guildrank_enabled_guilds])
             await asyncio.sleep(self.timer)
 
+    async def scheduled_sync(self, guild):
+        """
+        Run the sync of a guild once a slot is free, at most RANK_SYNC_CONCURRENCY guilds sync at the same time.
+        A guild already queued or syncing is skipped.
+        """
+        guild_id = guild.guild.guild_id
+        if guild_id in self.syncing:
+            return
+        self.syncing.add(guild_id)
+        self.queue_depth += 1
+        try:
+            async with self.sync_semaphore:
+                self.queue_depth -= 1
+                self.running_syncs += 1
+                logger.info("Doing rank sync for guild %s - %s", guild_id, guild.guild.name)
+                start = time.monotonic()
+                try:
+                    await self.run_sync(guild)
+                except Exception:
+                    logger.exception("%s - Rank sync failed", guild_id)
+                finally:
+                    self.running_syncs -= 1
+                self.sync_durations[guild_id] = time.monotonic() - start
+                self.last_sync[guild_id] = time.time()
+        finally:
+            self.syncing.discard(guild_id)
+
+    def stats(self):
+        return {
+            "rank_sync_queue_depth": self.queue_depth,
+            "rank_sync_running": self.running_syncs,
+            "rank_sync_duration_max": max(self.sync_durations.values(), default=0.0)
+        }
+
+    def guild_stats(self):
+        """Duration and result of the last sync of every guild, as InfluxDB points."""
+        points = []
+        for guild_id, duration in self.sync_durations.items():
+            examined, modified = self.sync_results.get(guild_id, (0, 0))
+            points.append({
+                "measurement": "legendarybot_rank_sync",
+                "tags": {"guild_id": guild_id},
+                "fields": {"duration": duration, "examined": examined, "modified": modified}
+            })
+        return points
+
+    @Cog.listener()
     async def on_ready(self):
-        self.bot.loop.create_task(self.background_task())
+        if self.sync_task is None:
+            self.sync_task = self.bot.loop.create_task(self.background_task())
 
     @commands.command()
     @commands.guild_only()
@@ -166,9 +290,12 @@ class RankSystem(Cog):
         Sync the Guild ranks with all users
         '''
 
-        setting = GuildSetting.objects.filter(setting_name="rank_enabled", guild=ctx.guild.id).first()
+        setting = (await self.bot.guild_configs.get(ctx.guild.id)).get_setting("rank_enabled")
         if setting:
-            await self.run_sync(setting)
+            if ctx.guild.id in self.syncing:
+                await ctx.message.author.send(_("A Guild Rank Sync is already running for this server."))
+                return
+            self.bot.loop.create_task(self.scheduled_sync(setting))
             await ctx.message.author.send(_("Guild Rank Sync started. It may take some minutes to apply. Check the server Audit log for any changes."))
         else:
             await ctx.message.author.send(_("The Rank System is not enabled. Please ask bot author to enable it."))
@@ -179,7 +306,7 @@ class RankSystem(Cog):
         '''
         Sync your rank on this Discord server.
         '''
-        setting = GuildSetting.objects.filter(setting_name="rank_enabled", guild=ctx.guild.id).first()
+        setting = (await self.bot.guild_configs.get(ctx.guild.id)).get_setting("rank_enabled")
         if setting:
             await self.run_user_sync(ctx.guild, setting, ctx.author)
             await ctx.message.author.send(_("Your rank is being synced. It may take some minutes to apply."))
@@ -200,4 +327,6 @@ class RankSystem(Cog):
 def setup(bot):
     global logger
     logger = logging.getLogger('rank')
+    # Role changes are logged per member, keep a large guild sync from flooding the logs
+    logger.addFilter(RateLimitFilter(rate=50, per=60))
     bot.add_cog(RankSystem(bot))
\ No newline at end of file
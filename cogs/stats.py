@@ -1,7 +1,16 @@
 import asyncio
+import os
 
 from discord.ext.commands import Cog
-from influxdb import InfluxDBClient
+
+from utils import response_cache, roster_cache
+from utils.extraction_cache import extractions
+from utils.metrics import metrics
+
+
+# Rough memory used by a cached discord.Member and its User
+MEMBER_SIZE_ESTIMATE = int(os.getenv("MEMBER_SIZE_ESTIMATE", 1200))
+
 
 class Stats(Cog):
 
@@ -9,9 +18,12 @@ class Stats(Cog):
         self.bot = bot
         self.sleep = 60
         self.command_count = 0
-        self.client = InfluxDBClient(database="legendarybot")
+        metrics.start()
         self.bot.loop.create_task(self.recuring_task())
 
+    def cog_unload(self):
+        metrics.stop()
+
     async def recuring_task(self):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
@@ -19,23 +31,47 @@ class Stats(Cog):
             user_count = len(self.bot.users)
             voice_connected = len(self.bot.voice_clients)
             latency = self.bot.latency
-            json_body = [
-                {
-                    "measurement": "legendarybot_stats",
-                    "fields": {
-                        "guild_count": guild_count,
-                        "user_count": user_count,
-                        "voice_connected": voice_connected,
-                        "latency": latency,
-                        "command_count": self.command_count
-                    }
-                }
-            ]
+            cached_members = sum(len(guild.members) for guild in self.bot.guilds)
+            skipped_members = max(sum(guild.member_count or 0 for guild in self.bot.guilds) - cached_members, 0)
+            fields = {
+                "guild_count": guild_count,
+                "user_count": user_count,
+                "voice_connected": voice_connected,
+                "member_cache_members": cached_members,
+                "member_cache_skipped": skipped_members,
+                "member_cache_chunked_guilds": sum(1 for guild in self.bot.guilds if guild.chunked),
+                "member_cache_saved_bytes": skipped_members * MEMBER_SIZE_ESTIMATE,
+                "latency": latency,
+                "command_count": self.command_count,
+                "metrics_backlog": len(metrics.backlog),
+                "metrics_dropped": metrics.dropped,
+                **self.bot.prefix_cache.stats(),
+                **self.bot.guild_configs.stats(),
+                **self.bot.custom_command_index.stats(),
+                **self.bot.member_index.stats(),
+                **self.bot.loop_monitor.stats(),
+                **response_cache.cache.stats(),
+                **roster_cache.rosters.stats(),
+                **extractions.stats()
+            }
+            rank_system = self.bot.get_cog("RankSystem")
+            if rank_system:
+                fields.update(rank_system.stats())
+                for point in rank_system.guild_stats():
+                    metrics.point(point["measurement"], point["fields"], **point["tags"])
+            music = self.bot.get_cog("Music")
+            if music:
+                fields.update(music.stats())
+            tags = {"cluster": self.bot.cluster.cluster_id} if self.bot.cluster.cluster_id is not None else {}
+            metrics.point("legendarybot_stats", fields, **tags)
+            if self.bot.cluster.is_primary:
+                metrics.point("legendarybot_totals", await self.bot.cluster.totals())
+            for shard_id, shard_latency in self.bot.latencies:
+                metrics.point("legendarybot_shard", {"latency": shard_latency}, shard_id=shard_id)
             self.command_count = 0
-            self.client.write_points(json_body)
 
             await asyncio.sleep(self.sleep)
 
 
 def setup(bot):
-    bot.add_cog(Stats(bot))
\ No newline at end of file
+    bot.add_cog(Stats(bot))
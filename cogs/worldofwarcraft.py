@@ -1,21 +1,31 @@
+import asyncio
 import datetime
 import os
 from decimal import Decimal
 
-import requests
 from discord import Embed, Colour
 from discord.ext import commands
 from discord.ext.commands import Cog
-from lbwebsite.models import GuildServer, Character, RealmConnected
 from slugify import slugify
-from social_django.models import UserSocialAuth
 
-from utils import battlenet_util
+from utils import db, response_cache
 from utils.simple_utc import simple_utc
 from utils.wow_utils import get_color_by_class_name, get_class_icon
 from utils.translate import _
 
 
+LOOKUP_TIMEOUT = 8
+
+SEASONS = (
+    ("S1", "season-bfa-1"),
+    ("S2", "season-bfa-2"),
+    ("S2-Post", "season-bfa-2-post"),
+    ("S3", "season-bfa-3"),
+    ("S3-Post", "season-bfa-3-post"),
+    ("S4", "season-bfa-4")
+)
+
+
 def convertMillis(millis):
     seconds=int((millis/1000)%60)
     minutes=int((millis/(1000*60))%60)
@@ -28,21 +38,51 @@ def affixEmbed(embed, difficulty, affix):
     difficulty += mythicplus_affix[affix['keystone_affix']['id']]['difficulty']
     return embed, difficulty
 
-def get_season_rank(region, realm_name, character_name, season_name):
+async def get_season_rank(region, realm_name, character_name, season_name):
     payload = {
         "region": region,
         "realm": realm_name,
         "name": character_name,
         "fields": f"mythic_plus_scores_by_season:{season_name}"
     }
-    r = requests.get(f"https://raider.io/api/v1/characters/profile", params=payload)
+    r = await response_cache.get("raiderio_season", f"https://raider.io/api/v1/characters/profile", params=payload)
     rank = 0
-    if r.ok:
+    if r.ok and r.json() is not None:
         ranking = r.json()
         if ranking["mythic_plus_scores_by_season"]:
             rank = ranking["mythic_plus_scores_by_season"][0]["scores"]["all"]
     return rank
 
+async def fetch_character(region, realm_name, character_name, deadline):
+    """
+    Fetch the Raider.IO profile, the Battle.net character and every season score of a character concurrently.
+    Calls not finished by the deadline are cancelled and their result is None.
+    """
+    loop = asyncio.get_event_loop()
+    payload = {
+        "region": region,
+        "realm": realm_name,
+        "name": character_name,
+        "fields": "gear,raid_progression,mythic_plus_scores,previous_mythic_plus_scores,mythic_plus_best_runs"
+    }
+    calls = {
+        "profile": response_cache.get("raiderio_character", f"https://raider.io/api/v1/characters/profile", params=payload),
+        "bnet": response_cache.battlenet_request("battlenet_character", f"https://{region}.api.blizzard.com/wow/character/{realm_name}/{character_name}", params={"fields": "achievements,stats,items"})
+    }
+    for season_label, season_name in SEASONS:
+        calls[season_label] = get_season_rank(region, realm_name, character_name, season_name)
+    tasks = {name: loop.create_task(call) for name, call in calls.items()}
+    done, pending = await asyncio.wait(tasks.values(), timeout=max(deadline - loop.time(), 0))
+    for task in pending:
+        task.cancel()
+    results = {}
+    for name, task in tasks.items():
+        if task in done and task.exception() is None:
+            results[name] = task.result()
+        else:
+            results[name] = None
+    return results
+
 def get_best_season(seasons):
     max = 0
     max_name = ""
@@ -60,6 +100,11 @@ class WoW(Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def get_default_guild_server(self, ctx):
+        if ctx.guild:
+            return (await self.bot.guild_configs.get(ctx.guild.id)).default_server
+        return None
+
     def __sub_format_ranking(self, difficulty):
         if difficulty is not None:
             ranking = _("World: **{world}**").format(world=difficulty['world']) + "\n"
@@ -93,13 +138,16 @@ class WoW(Cog):
         Get the WoW token price of your region
         """
         if region is None and ctx.guild:
-            guild_server = GuildServer.objects.filter(guild_id=ctx.guild.id, default=True).first()
+            guild_server = await self.get_default_guild_server(ctx)
             if guild_server:
                 region = guild_server.get_region_display()
             else:
                 raise commands.BadArgument(_('You are required to type the region. Supported regions are: NA/EU/CN/TW/KR'))
-        token_request = requests.get("https://data.wowtoken.info/snapshot.json")
+        token_request = await response_cache.get("token", "https://data.wowtoken.info/snapshot.json")
         token_json = token_request.json()
+        if not token_request.ok or token_json is None:
+            await ctx.send(content=_("The WoW token price is not available right now. Please try again later."))
+            return
         if region.upper() == "US":
             region = "NA"
         if region.upper() in token_json:
@@ -126,8 +174,8 @@ class WoW(Cog):
         If your realm name have spaces in it's name, please quote the name with "".
         Example: "Bleeding Hollow"
         """
+        guild_server = await self.get_default_guild_server(ctx)
         if region is None or realm is None and ctx.guild:
-            guild_server = GuildServer.objects.filter(guild_id=ctx.guild.id, default=True).first()
             if guild_server:
                 realm_slug = guild_server.server_slug
             else:
@@ -135,35 +183,32 @@ class WoW(Cog):
         else:
             realm = " ".join(realm)
             realm_slug = slugify(realm)
-        if ctx.guild:
-            guild_server = GuildServer.objects.filter(guild_id=ctx.guild.id, default=True).first()
-            if guild_server:
-                region = guild_server.get_region_display()
+        if guild_server:
+            region = guild_server.get_region_display()
         params = {
             "namespace": f"dynamic-{region}",
             "locale": "en-US"
         }
-        r = battlenet_util.execute_battlenet_request(f"https://{region}.api.blizzard.com/data/wow/realm/{realm_slug}", params)
+        r = await response_cache.battlenet_request("realm", f"https://{region}.api.blizzard.com/data/wow/realm/{realm_slug}", params)
         if r.ok:
-            r = battlenet_util.execute_battlenet_request(f"https://{region}.api.blizzard.com/wow/realm/status", params={"realms": realm_slug})
-            json_result = r.json()
-            if 'realms' in json_result and len(json_result['realms']) > 0:
-                realm_json = json_result['realms'][0]
-                embed = Embed(title=f"{realm_json['name']} - {region.upper()}",
-                              colour=Colour.green() if realm_json['status'] else Colour.red())
-                embed.add_field(name=_("Status"), value=_("Online") if realm_json['status'] else _("Offline"), inline=True)
-                embed.add_field(name=_("Population"), value=realm_json['population'], inline=True)
-                embed.add_field(name=_("Currently a Queue?"), value=_("Yes") if realm_json['queue'] else _("No"), inline=True)
-                await ctx.send(embed=embed)
-        else:
+            r = await response_cache.battlenet_request("realm_status", f"https://{region}.api.blizzard.com/wow/realm/status", params={"realms": realm_slug})
+        json_result = r.json() if r.ok else None
+        if not json_result or not json_result.get('realms'):
             raise commands.BadArgument(_('Realm not found. Did you make a mistake?'))
+        realm_json = json_result['realms'][0]
+        embed = Embed(title=f"{realm_json['name']} - {region.upper()}",
+                      colour=Colour.green() if realm_json['status'] else Colour.red())
+        embed.add_field(name=_("Status"), value=_("Online") if realm_json['status'] else _("Offline"), inline=True)
+        embed.add_field(name=_("Population"), value=realm_json['population'], inline=True)
+        embed.add_field(name=_("Currently a Queue?"), value=_("Yes") if realm_json['queue'] else _("No"), inline=True)
+        await ctx.send(embed=embed)
 
     @commands.command(name="affix")
     async def get_mythicplus_affix(self, ctx):
         """
         Get the Mythic+ affixes of this week.
         """
-        guild_server = GuildServer.objects.filter(guild_id=ctx.guild.id, default=True).first()
+        guild_server = await self.get_default_guild_server(ctx)
         region = "us"
         if guild_server:
             region = guild_server.get_region_display()
@@ -171,8 +216,11 @@ class WoW(Cog):
             "namespace": f"dynamic-{region}",
             "locale": "en-US"
         }
-        r = battlenet_util.execute_battlenet_request(f"https://{region}.api.blizzard.com/data/wow/mythic-challenge-mode/", params=params)
+        r = await response_cache.battlenet_request("affix", f"https://{region}.api.blizzard.com/data/wow/mythic-challenge-mode/", params=params)
         json_mythicplus = r.json()
+        if not r.ok or json_mythicplus is None:
+            await ctx.send(content=_("The Mythic+ affixes are not available right now. Please try again later."))
+            return
         embed = Embed()
         embed.set_thumbnail(url="http://wow.zamimg.com/images/wow/icons/large/inv_relics_hourglass.jpg")
         current_difficulty = 0
@@ -198,19 +246,15 @@ class WoW(Cog):
         region: The region (US/EU) the character is in (Optional if the guild is set in this server)
         """
         if not character_name:
-            user_social = UserSocialAuth.objects.filter(provider='discord', uid=ctx.author.id).first()
-            if user_social:
-                character = Character.objects.filter(user=user_social.user, main_for_guild=ctx.guild.id).first()
-                if character:
-                    character_name = character.name
-                    realm_name = character.server_slug
-                    region = character.get_region_display()
-                else:
-                    raise commands.BadArgument(_("You must enter a character name."))
+            character = await db.get_main_character(ctx.guild.id, ctx.author.id)
+            if character:
+                character_name = character.name
+                realm_name = character.server_slug
+                region = character.get_region_display()
             else:
                 raise commands.BadArgument(_("You must enter a character name."))
         if not realm_name:
-            guild_server = GuildServer.objects.filter(guild_id=ctx.guild.id, default=True).first()
+            guild_server = await self.get_default_guild_server(ctx)
             if guild_server:
                 realm_name = guild_server.server_slug
                 region = guild_server.get_region_display()
@@ -225,143 +269,116 @@ class WoW(Cog):
 
         region = region.lower()
         realm_name = slugify(realm_name)
-        not_ok = True
-
-        while not_ok:
-            payload = {
-                "region": region,
-                "realm": realm_name,
-                "name": character_name,
-                "fields": "gear,raid_progression,mythic_plus_scores,previous_mythic_plus_scores,mythic_plus_best_runs"
-            }
-            r = requests.get(f"https://raider.io/api/v1/characters/profile", params=payload)
-            bnet_request = battlenet_util.execute_battlenet_request(f"https://{region}.api.blizzard.com/wow/character/{realm_name}/{character_name}", params={"fields": "achievements,stats,items"})
-            i = 0
-            if r.ok:
-                not_ok = False
-            else:
-                #We did not find the character, let's see another connected realm
-                realm_database = RealmConnected.objects.filter(server_slug=realm_name).first()
-                connected_realms = realm_database.connected_realm.all()
-                if len(connected_realms) > i:
-                    realm_name = realm_database.connected_realm.all()[i]
-                    i += 1
-                else:
-                    raise commands.BadArgument(_("Character not found! Does it exist on Raider.IO?"))
-            raiderio = r.json()
-            embed = Embed()
-            embed.set_thumbnail(url=raiderio['thumbnail_url'])
-            embed.colour = get_color_by_class_name(raiderio['class'])
-            if raiderio['region'].lower() == "us":
-                wow_link = f"https://worldofwarcraft.com/en-us/character/{realm_name}/{character_name}"
+        deadline = self.bot.loop.time() + LOOKUP_TIMEOUT
+        results = await fetch_character(region, realm_name, character_name, deadline)
+        if results["profile"] is not None and not results["profile"].ok:
+            #We did not find the character, let's see the connected realms
+            for connected_realm in await db.get_connected_realm_slugs(realm_name):
+                results = await fetch_character(region, connected_realm, character_name, deadline)
+                if results["profile"] is None or results["profile"].ok:
+                    realm_name = connected_realm
+                    break
+        r = results["profile"]
+        bnet_request = results["bnet"]
+        if r is None:
+            raise commands.BadArgument(_("Raider.IO did not answer in time. Please try again."))
+        if not r.ok or r.json() is None:
+            raise commands.BadArgument(_("Character not found! Does it exist on Raider.IO?"))
+        raiderio = r.json()
+        embed = Embed()
+        embed.set_thumbnail(url=raiderio['thumbnail_url'])
+        embed.colour = get_color_by_class_name(raiderio['class'])
+        if raiderio['region'].lower() == "us":
+            wow_link = f"https://worldofwarcraft.com/en-us/character/{realm_name}/{character_name}"
+        else:
+            wow_link = f"https://worldofwarcraft.com/en-gb/character/{realm_name}/{character_name}"
+        embed.set_author(
+            name=f"{raiderio['name']} {raiderio['realm']} - {raiderio['region'].upper()} | {raiderio['race']} {raiderio['active_spec_name']}  {raiderio['class']}",
+            icon_url=get_class_icon(raiderio['class']), url=wow_link)
+        raid_progression = raiderio['raid_progression']
+        embed.add_field(name=_("Progression"),
+                        value=_("**Ny'alotha** : {nwcprogression} **EP** : {epprogression} **CoS**: {cosprogression} **BoD** : {bodprogression} ").format(bodprogression=raid_progression["battle-of-dazaralor"]["summary"], cosprogression=raid_progression["crucible-of-storms"]["summary"], epprogression=raid_progression["the-eternal-palace"]["summary"], nwcprogression=raid_progression["nyalotha-the-waking-city"]["summary"]),
+                        inline=False)
+        embed.add_field(name=_("iLVL"),
+                        value=f"{raiderio['gear']['item_level_equipped']}/{raiderio['gear']['item_level_total']}",
+                        inline=True)
+        if bnet_request is not None and bnet_request.json() is not None:
+            bnet_json = bnet_request.json()
+            cape = bnet_json["items"]["back"]
+            if cape["id"] == 169223:
+                cape_rank = int(((cape["itemLevel"] - 470) / 2) + 1)
+                embed.add_field(name=_("Legendary Cloak Rank"), value=cape_rank, inline=True)
+        seasons = []
+        for season_label, _season_name in SEASONS:
+            if results[season_label] is not None:
+                seasons.append({
+                    "name": season_label,
+                    "score": results[season_label]
+                })
+        rank, rank_name = get_best_season(seasons)
+        embed.add_field(name=_("Mythic+ Score"), value=f"**Current**: {raiderio['mythic_plus_scores']['all']} | **Best**: {rank} (**{rank_name}**)", inline=False)
+        best_runs = ""
+        for mythicplus_run in raiderio['mythic_plus_best_runs']:
+            best_runs += f"[{mythicplus_run['dungeon']} - **"
+            if mythicplus_run['num_keystone_upgrades'] == 1:
+                best_runs += "+ "
+            elif mythicplus_run['num_keystone_upgrades'] == 2:
+                best_runs += "++ "
+            elif mythicplus_run['num_keystone_upgrades'] == 3:
+                best_runs += "+++ "
+            seconds, minutes, hour = convertMillis(mythicplus_run['clear_time_ms'])
+            best_runs += f"{mythicplus_run['mythic_level']}** {hour}:{minutes}:{seconds}]({mythicplus_run['url']})\n"
+        if best_runs:
+            embed.add_field(name=_("Best Mythic+ Runs"), value=best_runs, inline=True)
+        if bnet_request is not None and bnet_request.json() is not None:
+            bnet_json = bnet_request.json()
+            mplus_totals = ""
+            try:
+                index = bnet_json['achievements']['criteria'].index(33097)
+                mplus_totals += f"**M+5**:{bnet_json['achievements']['criteriaQuantity'][index]}\n"
+            except ValueError:
+                pass
+
+            try:
+                index = bnet_json['achievements']['criteria'].index(33098)
+                mplus_totals += f"**M+10**:{bnet_json['achievements']['criteriaQuantity'][index]}\n"
+            except ValueError:
+                pass
+
+            try:
+                index = bnet_json['achievements']['criteria'].index(32028)
+                mplus_totals += f"**M+15**:{bnet_json['achievements']['criteriaQuantity'][index]}\n"
+            except ValueError:
+                pass
+            embed.add_field(name=_("Mythic+ Completed"), value=mplus_totals, inline=True)
+            stats = ""
+            strength = bnet_json['stats']['str']
+            agi = bnet_json['stats']['agi']
+            intel = bnet_json['stats']['int']
+            if strength > agi and strength > intel:
+                stats += _("**STR**: {strength}").format(strength=strength) + " - "
+            elif agi > strength and agi > intel:
+                stats += _("**AGI**: {agility}").format(agility=agi) + " - "
             else:
-                wow_link = f"https://worldofwarcraft.com/en-gb/character/{realm_name}/{character_name}"
-            embed.set_author(
-                name=f"{raiderio['name']} {raiderio['realm']} - {raiderio['region'].upper()} | {raiderio['race']} {raiderio['active_spec_name']}  {raiderio['class']}",
-                icon_url=get_class_icon(raiderio['class']), url=wow_link)
-            raid_progression = raiderio['raid_progression']
-            embed.add_field(name=_("Progression"),
-                            value=_("**Ny'alotha** : {nwcprogression} **EP** : {epprogression} **CoS**: {cosprogression} **BoD** : {bodprogression} ").format(bodprogression=raid_progression["battle-of-dazaralor"]["summary"], cosprogression=raid_progression["crucible-of-storms"]["summary"], epprogression=raid_progression["the-eternal-palace"]["summary"], nwcprogression=raid_progression["nyalotha-the-waking-city"]["summary"]),
-                            inline=False)
-            embed.add_field(name=_("iLVL"),
-                            value=f"{raiderio['gear']['item_level_equipped']}/{raiderio['gear']['item_level_total']}",
-                            inline=True)
-            if bnet_request.ok:
-                bnet_json = bnet_request.json()
-                cape = bnet_json["items"]["back"]
-                if cape["id"] == 169223:
-                    cape_rank = int(((cape["itemLevel"] - 470) / 2) + 1)
-                    embed.add_field(name=_("Legendary Cloak Rank"), value=cape_rank, inline=True)
-            previous = 0
-            seasons = []
-            seasons.append({
-                "name": "S1",
-                "score": get_season_rank(region, realm_name, character_name, "season-bfa-1")
-            })
-            seasons.append({
-                "name": "S2",
-                "score": get_season_rank(region, realm_name, character_name, "season-bfa-2")
-            })
-            seasons.append({
-                "name": "S2-Post",
-                "score": get_season_rank(region, realm_name, character_name, "season-bfa-2-post")
-            })
-            seasons.append({
-                "name": "S3",
-                "score": get_season_rank(region, realm_name, character_name, "season-bfa-3")
-            })
-            seasons.append({
-                "name": "S3-Post",
-                "score": get_season_rank(region, realm_name, character_name, "season-bfa-3-post")
-            })
-            seasons.append({
-                "name": "S4",
-                "score": get_season_rank(region, realm_name, character_name, "season-bfa-4")
-            })
-            rank, rank_name = get_best_season(seasons)
-            embed.add_field(name=_("Mythic+ Score"), value=f"**Current**: {raiderio['mythic_plus_scores']['all']} | **Best**: {rank} (**{rank_name}**)", inline=False)
-            best_runs = ""
-            for mythicplus_run in raiderio['mythic_plus_best_runs']:
-                best_runs += f"[{mythicplus_run['dungeon']} - **"
-                if mythicplus_run['num_keystone_upgrades'] == 1:
-                    best_runs += "+ "
-                elif mythicplus_run['num_keystone_upgrades'] == 2:
-                    best_runs += "++ "
-                elif mythicplus_run['num_keystone_upgrades'] == 3:
-                    best_runs += "+++ "
-                seconds, minutes, hour = convertMillis(mythicplus_run['clear_time_ms'])
-                best_runs += f"{mythicplus_run['mythic_level']}** {hour}:{minutes}:{seconds}]({mythicplus_run['url']})\n"
-            if best_runs:
-                embed.add_field(name=_("Best Mythic+ Runs"), value=best_runs, inline=True)
-            if bnet_request.ok:
-                bnet_json = bnet_request.json()
-                mplus_totals = ""
-                try:
-                    index = bnet_json['achievements']['criteria'].index(33097)
-                    mplus_totals += f"**M+5**:{bnet_json['achievements']['criteriaQuantity'][index]}\n"
-                except ValueError:
-                    pass
-
-                try:
-                    index = bnet_json['achievements']['criteria'].index(33098)
-                    mplus_totals += f"**M+10**:{bnet_json['achievements']['criteriaQuantity'][index]}\n"
-                except ValueError:
-                    pass
-
-                try:
-                    index = bnet_json['achievements']['criteria'].index(32028)
-                    mplus_totals += f"**M+15**:{bnet_json['achievements']['criteriaQuantity'][index]}\n"
-                except ValueError:
-                    pass
-                embed.add_field(name=_("Mythic+ Completed"), value=mplus_totals, inline=True)
-                stats = ""
-                strength = bnet_json['stats']['str']
-                agi = bnet_json['stats']['agi']
-                intel = bnet_json['stats']['int']
-                if strength > agi and strength > intel:
-                    stats += _("**STR**: {strength}").format(strength=strength) + " - "
-                elif agi > strength and agi > intel:
-                    stats += _("**AGI**: {agility}").format(agility=agi) + " - "
-                else:
-                    stats += _("**INT**: {intel}").format(intel=intel) + " - "
-                stats += _("**Crit**: {percent}% {rating}").format(percent=round(Decimal(bnet_json['stats']['crit']), 2), rating=bnet_json['stats']['critRating']) + "\n"
-                stats += _("**Haste**: {percent}% {rating}").format(percent=round(Decimal(bnet_json['stats']['haste']), 2), rating=bnet_json['stats']['hasteRating']) + " - "
-                stats += _("**Mastery**: {percent}% {rating}").format(percent=round(Decimal(bnet_json['stats']['mastery']), 2), rating=bnet_json['stats']['masteryRating']) + "\n"
-                stats += _("**Versatility**: D:{percent_damage} B:{percent_block} ({rating})").format(percent_damage=round(Decimal(bnet_json['stats']['versatilityDamageDoneBonus']),2), percent_block=round(Decimal(bnet_json['stats']['versatilityDamageTakenBonus']),2), rating=bnet_json['stats']['versatility']) + "\n"
-                embed.add_field(name=_("Stats"), value=stats, inline=False)
-
-
-            embed.add_field(name="WoWProgress",
-                            value=_("[Click Here]({url})").format(url=f"https://www.wowprogress.com/character/{region}/{realm_name}/{character_name}"),
-                            inline=True)
-            embed.add_field(name="Raider.IO",
-                            value=_("[Click Here]({url})").format(url=f"https://raider.io/characters/{region}/{realm_name}/{character_name}"),
-                            inline=True)
-            embed.add_field(name="WarcraftLogs",
-                            value=_("[Click Here]({url})").format(url=f"https://www.warcraftlogs.com/character/{region}/{realm_name}/{character_name}"),
-                            inline=True)
-            embed.set_footer(text=_("Information taken from Raider.IO"))
-            await ctx.send(embed=embed)
+                stats += _("**INT**: {intel}").format(intel=intel) + " - "
+            stats += _("**Crit**: {percent}% {rating}").format(percent=round(Decimal(bnet_json['stats']['crit']), 2), rating=bnet_json['stats']['critRating']) + "\n"
+            stats += _("**Haste**: {percent}% {rating}").format(percent=round(Decimal(bnet_json['stats']['haste']), 2), rating=bnet_json['stats']['hasteRating']) + " - "
+            stats += _("**Mastery**: {percent}% {rating}").format(percent=round(Decimal(bnet_json['stats']['mastery']), 2), rating=bnet_json['stats']['masteryRating']) + "\n"
+            stats += _("**Versatility**: D:{percent_damage} B:{percent_block} ({rating})").format(percent_damage=round(Decimal(bnet_json['stats']['versatilityDamageDoneBonus']),2), percent_block=round(Decimal(bnet_json['stats']['versatilityDamageTakenBonus']),2), rating=bnet_json['stats']['versatility']) + "\n"
+            embed.add_field(name=_("Stats"), value=stats, inline=False)
+
+
+        embed.add_field(name="WoWProgress",
+                        value=_("[Click Here]({url})").format(url=f"https://www.wowprogress.com/character/{region}/{realm_name}/{character_name}"),
+                        inline=True)
+        embed.add_field(name="Raider.IO",
+                        value=_("[Click Here]({url})").format(url=f"https://raider.io/characters/{region}/{realm_name}/{character_name}"),
+                        inline=True)
+        embed.add_field(name="WarcraftLogs",
+                        value=_("[Click Here]({url})").format(url=f"https://www.warcraftlogs.com/character/{region}/{realm_name}/{character_name}"),
+                        inline=True)
+        embed.set_footer(text=_("Information taken from Raider.IO"))
+        await ctx.send(embed=embed)
 
     @commands.command(aliases=["logs"])
     async def log(self, ctx):
@@ -369,11 +386,11 @@ class WoW(Cog):
         Retrieve the latest log from WarcraftLogs for your guild.
         """
         # TODO Allow a parameter to give the guild name.
-        guild_server = GuildServer.objects.filter(guild_id=ctx.guild.id, default=True).first()
+        guild_server = await self.get_default_guild_server(ctx)
         if not guild_server:
             raise commands.BadArgument(_("The owner of the server needs to configure at least 1 default guild first!"))
         key = os.getenv("WARCRAFTLOGS_KEY")
-        wc_request = requests.get(f"https://www.warcraftlogs.com/v1/reports/guild/{guild_server.guild_name}/{guild_server.server_slug}/{guild_server.get_region_display()}", params={"api_key": key})
+        wc_request = await response_cache.get("warcraftlogs_reports", f"https://www.warcraftlogs.com/v1/reports/guild/{guild_server.guild_name}/{guild_server.server_slug}/{guild_server.get_region_display()}", params={"api_key": key})
         if not wc_request.ok:
             await ctx.send(content=_("The guild is not found on WarcraftLogs. Does the guild exist on the website?"))
             return
@@ -386,8 +403,8 @@ class WoW(Cog):
             embed.set_thumbnail(url=f"https://dmszsuqyoe6y6.cloudfront.net/img/warcraft/zones/zone-{log['zone']}-small.jpg")
             embed.add_field(name=_("Created by"), value=log['owner'], inline=True)
             embed.timestamp = datetime.datetime.utcfromtimestamp(log['start'] / 1000).replace(tzinfo=simple_utc())
-            wc_zones = requests.get("https://www.warcraftlogs.com/v1/zones", params={"api_key": key})
-            if wc_zones.ok:
+            wc_zones = await response_cache.get("warcraftlogs_zones", "https://www.warcraftlogs.com/v1/zones", params={"api_key": key})
+            if wc_zones.json() is not None:
                 zones_json = wc_zones.json()
                 for zone in zones_json:
                     if log['zone'] == zone['id']:
@@ -401,7 +418,7 @@ class WoW(Cog):
         """
         Retrieve your Guild Raider.IO Ranking
         """
-        guild_server = GuildServer.objects.filter(guild_id=ctx.guild.id, default=True).first()
+        guild_server = await self.get_default_guild_server(ctx)
         if not guild_server:
             raise commands.BadArgument(_("The owner of the server needs to configure at least 1 default guild first!"))
         query_parameters = {
@@ -410,8 +427,8 @@ class WoW(Cog):
             "name": guild_server.guild_name,
             "fields": "raid_rankings"
         }
-        raiderio_request = requests.get("https://raider.io/api/v1/guilds/profile", params=query_parameters)
-        if not raiderio_request.ok:
+        raiderio_request = await response_cache.get("raiderio_guild", "https://raider.io/api/v1/guilds/profile", params=query_parameters)
+        if not raiderio_request.ok or raiderio_request.json() is None:
             await ctx.send(content=_("The guild is not found on Raider.IO. Does the guild exist on the website?"))
             return
         ranking_json = raiderio_request.json()
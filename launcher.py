@@ -0,0 +1,69 @@
+"""
+Runs the bot as several processes, each cluster owning a contiguous range of shards,
+with a coordinator aggregating their counts and relaying their queries.
+"""
+import asyncio
+import logging
+import math
+import os
+import sys
+
+import aiohttp
+from dotenv import load_dotenv
+
+from utils.cluster import Coordinator
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("legendarybot.launcher")
+
+CLUSTER_COUNT = int(os.getenv("CLUSTER_COUNT", os.cpu_count() or 1))
+# Time given to a cluster to identify all of its shards before starting the next one, Discord allows one identify every 5 seconds
+IDENTIFY_DELAY = 5.5
+RESTART_DELAY = 10
+
+
+async def recommended_shard_count(token):
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discordapp.com/api/v7/gateway/bot", headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+
+def shard_ranges(shard_count, cluster_count):
+    per_cluster = math.ceil(shard_count / cluster_count)
+    return [list(range(start, min(start + per_cluster, shard_count))) for start in range(0, shard_count, per_cluster)]
+
+
+async def run_cluster(coordinator, cluster_id, shard_ids, shard_count, started):
+    """Run a cluster, restarting it if it dies. started is set once its shards are ready or had the time to be."""
+    bot = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    env = dict(os.environ, CLUSTER_ID=str(cluster_id), SHARD_IDS=",".join(map(str, shard_ids)), SHARD_COUNT=str(shard_count))
+    while True:
+        logger.info(f"Starting cluster {cluster_id} with shards {shard_ids[0]}-{shard_ids[-1]}")
+        process = await asyncio.create_subprocess_exec(sys.executable, bot, env=env)
+        try:
+            await asyncio.wait_for(coordinator.ready_event(cluster_id).wait(), IDENTIFY_DELAY * len(shard_ids) + 60)
+        except asyncio.TimeoutError:
+            logger.warning(f"Cluster {cluster_id} is not ready yet, starting the next one anyway")
+        started.set()
+        code = await process.wait()
+        logger.warning(f"Cluster {cluster_id} exited with code {code}, restarting in {RESTART_DELAY}s")
+        await asyncio.sleep(RESTART_DELAY)
+
+
+async def main():
+    shard_count = int(os.getenv("SHARD_COUNT", 0)) or await recommended_shard_count(os.getenv("BOT_TOKEN"))
+    coordinator = Coordinator()
+    await coordinator.start()
+    clusters = []
+    # Clusters are started one after the other so their shards do not identify at the same time
+    for cluster_id, shard_ids in enumerate(shard_ranges(shard_count, CLUSTER_COUNT)):
+        started = asyncio.Event()
+        clusters.append(asyncio.ensure_future(run_cluster(coordinator, cluster_id, shard_ids, shard_count, started)))
+        await started.wait()
+    await asyncio.gather(*clusters)
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
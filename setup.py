@@ -15,8 +15,11 @@ setuptools.setup(
     url="https://github.com/LegendaryBot/bot",
     packages=setuptools.find_packages(),
     install_requires=read_requirements('requirements.txt'),
+    # contextvars and time.time_ns are used by the tracing and the metrics
+    python_requires=">=3.7",
     classifiers=(
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3.7",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ),
@@ -0,0 +1,90 @@
+"""Local stand-in for the Battle.net OAuth and API endpoints, shared by the tests and the benchmarks."""
+import asyncio
+import threading
+
+from aiohttp import web
+
+# Settings battlenet_util reads, for running outside of the website project
+TEST_SETTINGS = {
+    "CACHES": {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    "SOCIAL_AUTH_BATTLENET_OAUTH2_US_KEY": "us-key",
+    "SOCIAL_AUTH_BATTLENET_OAUTH2_US_SECRET": "us-secret",
+    "SOCIAL_AUTH_BATTLENET_OAUTH2_EU_KEY": "eu-key",
+    "SOCIAL_AUTH_BATTLENET_OAUTH2_EU_SECRET": "eu-secret",
+}
+
+
+def configure_django():
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(**TEST_SETTINGS)
+
+
+class BattleNetStub:
+    """
+    /oauth/token hands out token1, token2... /data answers 401 to revoked tokens,
+    /slow takes slow_delay seconds to answer. Every endpoint counts its requests.
+    """
+
+    def __init__(self, token_delay=0.05, data_delay=0.0, slow_delay=1.0):
+        self.token_delay = token_delay
+        self.data_delay = data_delay
+        self.slow_delay = slow_delay
+        self.token_requests = 0
+        self.data_requests = 0
+        self.revoked = set()
+        self.url = None
+        self._runner = None
+        self._loop = None
+
+    def revoke_all(self):
+        self.revoked.update(f"token{n}" for n in range(1, self.token_requests + 1))
+
+    async def token(self, request):
+        self.token_requests += 1
+        await asyncio.sleep(self.token_delay)
+        return web.json_response({"access_token": f"token{self.token_requests}", "token_type": "bearer", "expires_in": 3600})
+
+    async def data(self, request):
+        self.data_requests += 1
+        await asyncio.sleep(self.data_delay)
+        token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not token or token in self.revoked:
+            return web.json_response({"error": "invalid_token"}, status=401)
+        return web.json_response({"name": "Azgalor", "token": token})
+
+    async def slow(self, request):
+        await asyncio.sleep(self.slow_delay)
+        return web.json_response({})
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes([web.post("/oauth/token", self.token), web.get("/data", self.data), web.get("/slow", self.slow)])
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def start_in_thread(self):
+        """Serve from a thread with its own loop, for clients blocking the loop they run on."""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, name="battlenet-stub", daemon=True).start()
+        started.wait()
+        return self.url
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+
+from tests.battlenet_stub import BattleNetStub, configure_django
+
+configure_django()
+
+from django.core.cache import cache  # noqa: E402
+
+from utils.battlenet_util import BattleNetClient  # noqa: E402
+
+
+class BattleNetClientTest(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.stub = BattleNetStub()
+        url = self.run_async(self.stub.start())
+        self.client = BattleNetClient("us", token_url=f"{url}/oauth/token")
+
+    def tearDown(self):
+        self.run_async(self.client.close())
+        self.run_async(self.stub.stop())
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_concurrent_requests_share_one_token_refresh(self):
+        async def lookups():
+            return await asyncio.gather(*(self.client.get(f"{self.stub.url}/data") for _ in range(20)))
+        responses = self.run_async(lookups())
+        self.assertEqual(self.stub.token_requests, 1)
+        self.assertTrue(all(response.status == 200 for response in responses))
+        self.assertEqual({response.json()["token"] for response in responses}, {"token1"})
+
+    def test_rejected_token_is_refreshed_once(self):
+        self.run_async(self.client.get(f"{self.stub.url}/data"))
+        self.stub.revoke_all()
+        data_requests = self.stub.data_requests
+        response = self.run_async(self.client.get(f"{self.stub.url}/data"))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.json()["token"], "token2")
+        self.assertEqual(self.stub.token_requests, 2)
+        self.assertEqual(self.stub.data_requests - data_requests, 2)
+
+    def test_still_rejected_token_is_not_retried_again(self):
+        self.stub.revoked.update({"token1", "token2", "token3"})
+        response = self.run_async(self.client.get(f"{self.stub.url}/data"))
+        self.assertEqual(response.status, 401)
+        self.assertEqual(self.stub.token_requests, 2)
+        self.assertEqual(self.stub.data_requests, 2)
+
+    def test_request_timeout(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_async(self.client.get(f"{self.stub.url}/slow", timeout=0.2))
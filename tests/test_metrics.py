@@ -0,0 +1,43 @@
+import random
+import unittest
+
+from utils.metrics import Histogram, SAMPLE_SIZE, to_line
+
+
+class HistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+
+    def test_percentiles_small(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.add(value)
+        fields = histogram.fields()
+        self.assertEqual(fields["count"], 100)
+        self.assertEqual(fields["min"], 1.0)
+        self.assertEqual(fields["max"], 100.0)
+        self.assertEqual(fields["p50"], 51.0)
+        self.assertEqual(fields["p95"], 96.0)
+        self.assertEqual(fields["p99"], 100.0)
+
+    def test_percentiles_cover_whole_interval(self):
+        # Increasing values, a sample only holding the latest ones would put every percentile near the end
+        histogram = Histogram()
+        count = SAMPLE_SIZE * 100
+        for value in range(count):
+            histogram.add(value)
+        self.assertEqual(len(histogram.samples), SAMPLE_SIZE)
+        for percent in (50, 95, 99):
+            self.assertAlmostEqual(histogram.percentile(percent) / count, percent / 100, delta=0.05)
+
+
+class LineProtocolTest(unittest.TestCase):
+
+    def test_escaping(self):
+        line = to_line("latency", {"command": "a b,c"}, {"path": 'C:\\"x"', "count": 3}, 10)
+        self.assertEqual(line, 'latency,command=a\\ b\\,c path="C:\\\\\\"x\\"",count=3i 10')
+
+    def test_non_finite_fields(self):
+        self.assertIsNone(to_line("latency", {}, {"mean": float("nan")}, 10))
+        self.assertEqual(to_line("latency", {}, {"mean": float("inf"), "max": 1.5}, 10), "latency max=1.5 10")
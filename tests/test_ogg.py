@@ -0,0 +1,30 @@
+import io
+import struct
+import unittest
+
+from utils import ogg
+
+
+def page(*packets, continued=b''):
+    """Ogg page holding the packets, continued is the start of a packet finished on the next page."""
+    segment_table = b''
+    for packet in packets:
+        segment_table += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+    segment_table += b'\xff' * (len(continued) // 255)
+    header = b'OggS' + struct.pack('<BBqIIIB', 0, 0, 0, 1, 0, 0, len(segment_table))
+    return header + segment_table + b''.join(packets) + continued
+
+
+class OggTest(unittest.TestCase):
+
+    def test_packets(self):
+        stream = io.BytesIO(page(b'OpusHead' + b'\0' * 11) + page(b'OpusTags' + b'\0' * 8) + page(b'a' * 10, b'b' * 300))
+        self.assertEqual(list(ogg.iter_opus_packets(stream)), [b'a' * 10, b'b' * 300])
+
+    def test_packet_spanning_pages(self):
+        stream = io.BytesIO(page(continued=b'c' * 510) + page(b'd' * 20))
+        self.assertEqual(list(ogg.iter_packets(stream)), [b'c' * 510 + b'd' * 20])
+
+    def test_not_ogg(self):
+        with self.assertRaises(ValueError):
+            list(ogg.iter_packets(io.BytesIO(b'x' * 40)))
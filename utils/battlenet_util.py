@@ -1,35 +1,131 @@
-from oauthlib.oauth2 import BackendApplicationClient, TokenExpiredError
-from requests_oauthlib import OAuth2Session
+import asyncio
+import time
+
+import aiohttp
 from django.conf import settings
 from django.core.cache import cache
 
+from utils import http_util, tracing
+
+REQUEST_TIMEOUT = 10
+TOKEN_TIMEOUT = 10
+
+
+class BattleNetClient:
+    """
+    Non-blocking Battle.net API client for a single region.
+    Keeps one pooled keep-alive session and shares a single token refresh between concurrent requests.
+    """
+
+    def __init__(self, region: str, token_url=None):
+        self.region = region.lower()
+        self.token_url = token_url or f"https://{self.region}.battle.net/oauth/token"
+        if self.region == 'us':
+            self.client_id = settings.SOCIAL_AUTH_BATTLENET_OAUTH2_US_KEY
+            self.client_secret = settings.SOCIAL_AUTH_BATTLENET_OAUTH2_US_SECRET
+        else:
+            self.client_id = settings.SOCIAL_AUTH_BATTLENET_OAUTH2_EU_KEY
+            self.client_secret = settings.SOCIAL_AUTH_BATTLENET_OAUTH2_EU_SECRET
+        self.cache_key = f'{self.region}_battlenet_token'
+        self._session = None
+        self._token_lock = asyncio.Lock()
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = http_util.create_session(timeout=REQUEST_TIMEOUT)
+        return self._session
+
+    def _cached_token(self):
+        token = cache.get(self.cache_key)
+        if token and token.get('expires_at', 0) > time.time() + 60:
+            return token
+        return None
+
+    async def _fetch_token(self):
+        with tracing.timed("http:blizzard"):
+            async with self.session.post(self.token_url,
+                                         data={"grant_type": "client_credentials"},
+                                         auth=aiohttp.BasicAuth(self.client_id, self.client_secret),
+                                         timeout=aiohttp.ClientTimeout(total=TOKEN_TIMEOUT)) as response:
+                response.raise_for_status()
+                token = await response.json(content_type=None)
+        token['expires_at'] = time.time() + token.get('expires_in', 60*60*24)
+        cache.set(self.cache_key, token, token.get('expires_in', 60*60*24))
+        return token
+
+    async def get_token(self, expired=None):
+        """
+        Return a valid access token, fetching a new one if needed.
+        Concurrent callers wait on the same refresh instead of each starting their own.
+        expired: a token the caller got rejected with, it will not be returned again.
+        """
+        token = self._cached_token()
+        if token and token != expired:
+            return token
+        async with self._token_lock:
+            token = self._cached_token()
+            if token and token != expired:
+                return token
+            if token:
+                cache.delete(self.cache_key)
+            return await self._fetch_token()
+
+    async def get(self, url, params=None, headers=None, timeout=REQUEST_TIMEOUT):
+        token = await self.get_token()
+        response = await self._get(url, params, headers, token, timeout)
+        if response.status == 401:
+            token = await self.get_token(expired=token)
+            response = await self._get(url, params, headers, token, timeout)
+        return response
 
-__oauth_client = {}
+    async def _get(self, url, params, headers, token, timeout):
+        request_headers = {"Authorization": f"Bearer {token['access_token']}"}
+        if headers:
+            request_headers.update(headers)
+        with tracing.timed("http:blizzard"):
+            async with self.session.get(url, params=params, headers=request_headers,
+                                        timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                return await http_util.read_response(response)
 
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
 
-def __get_battlenet_oauth(region: str):
-    if region.upper() == 'US':
-        client_id = settings.SOCIAL_AUTH_BATTLENET_OAUTH2_US_KEY
-        client_secret = settings.SOCIAL_AUTH_BATTLENET_OAUTH2_US_SECRET
-    else:
-        client_id = settings.SOCIAL_AUTH_BATTLENET_OAUTH2_EU_KEY
-        client_secret = settings.SOCIAL_AUTH_BATTLENET_OAUTH2_EU_SECRET
-    client = BackendApplicationClient(client_id=client_id)
-    token = cache.get(f'{region}_battlenet_token')
-    if token:
-        if region not in __oauth_client:
-            __oauth_client[region] = OAuth2Session(client=client, token=token)
-    else:
-        __oauth_client[region] = OAuth2Session(client=client)
-        token = __oauth_client[region].fetch_token(token_url=f"https://{region}.battle.net/oauth/token", client_id=client_id, client_secret=client_secret)
-        cache.set(f'{region}_battlenet_token', token, 60*60*24)
-    return __oauth_client[region]
 
+__clients = {}
 
-def execute_battlenet_request(url, params=None):
+
+def get_client(region: str):
+    region = region.lower()
+    if region not in __clients:
+        __clients[region] = BattleNetClient(region)
+    return __clients[region]
+
+
+async def execute_battlenet_request(url, params=None, headers=None):
     region = url.split(".")[0].split("//")[1]
-    try:
-        return __get_battlenet_oauth(region).get(url, params=params)
-    except TokenExpiredError as e:
-        cache.delete(f'{region}_battlenet_token')
-        return __get_battlenet_oauth(region).get(url, params=params)
+    return await get_client(region).get(url, params=params, headers=headers)
+
+
+def snapshot():
+    """Cached access tokens of every region, the Django cache may not survive a restart."""
+    tokens = {}
+    for region in ("us", "eu"):
+        token = cache.get(f'{region}_battlenet_token')
+        if token:
+            tokens[region] = token
+    return tokens
+
+
+def restore(state, elapsed):
+    for region, token in state.items():
+        cache_key = f'{region}_battlenet_token'
+        expires_in = int(token.get('expires_at', 0) - time.time())
+        if expires_in > 60 and not cache.get(cache_key):
+            cache.set(cache_key, token, expires_in)
+
+
+async def close():
+    for client in __clients.values():
+        await client.close()
@@ -2,6 +2,10 @@ from discord.ext import commands
 from discord.ext.commands import has_role
 
 
+class CommandRefused(commands.CheckFailure):
+    """Stops a command, the message is sent to the channel instead of printing a traceback."""
+
+
 async def check_guild_permissions(ctx, perms, *, check=all):
     is_owner = await ctx.bot.is_owner(ctx.author)
     if is_owner:
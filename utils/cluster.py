@@ -0,0 +1,238 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+
+CLUSTER_HOST = os.getenv("CLUSTER_HOST", "127.0.0.1")
+CLUSTER_PORT = int(os.getenv("CLUSTER_PORT", 7800))
+COUNTS_INTERVAL = 30
+REQUEST_TIMEOUT = 10
+
+logger = logging.getLogger("legendarybot.cluster")
+
+
+async def send(writer, message):
+    """Messages are JSON objects, one per line."""
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+
+class Coordinator:
+    """
+    Runs in the launcher. Keeps the last guild, user and voice counts of every cluster
+    and relays the queries a cluster broadcasts to all the others.
+    """
+
+    def __init__(self, host=CLUSTER_HOST, port=CLUSTER_PORT):
+        self.host = host
+        self.port = port
+        self.clusters = {}
+        self.counts = {}
+        self.ready = {}
+        self._pending = {}
+        self._nonces = itertools.count()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def ready_event(self, cluster_id):
+        if cluster_id not in self.ready:
+            self.ready[cluster_id] = asyncio.Event()
+        return self.ready[cluster_id]
+
+    def totals(self):
+        totals = {"guild_count": 0, "user_count": 0, "voice_count": 0}
+        for counts in self.counts.values():
+            for name in totals:
+                totals[name] += counts.get(name, 0)
+        totals["cluster_count"] = len(self.counts)
+        return totals
+
+    async def _handle(self, reader, writer):
+        cluster_id = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message["op"]
+                if op == "identify":
+                    cluster_id = message["cluster_id"]
+                    self.clusters[cluster_id] = writer
+                    logger.info(f"Cluster {cluster_id} connected")
+                elif op == "ready":
+                    self.ready_event(cluster_id).set()
+                elif op == "counts":
+                    self.counts[cluster_id] = message["counts"]
+                elif op == "reply":
+                    future = self._pending.pop(message["nonce"], None)
+                    if future is not None and not future.done():
+                        future.set_result(message["result"])
+                elif op == "totals":
+                    await send(writer, {"op": "reply", "nonce": message["nonce"], "result": self.totals()})
+                elif op == "broadcast":
+                    asyncio.ensure_future(self._broadcast(writer, message))
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Lost cluster {cluster_id}: {e!r}")
+        finally:
+            if cluster_id is not None and self.clusters.get(cluster_id) is writer:
+                del self.clusters[cluster_id]
+                self.counts.pop(cluster_id, None)
+                self.ready.pop(cluster_id, None)
+            writer.close()
+
+    async def _query(self, writer, query, args):
+        nonce = next(self._nonces)
+        future = self._pending[nonce] = asyncio.get_event_loop().create_future()
+        try:
+            await send(writer, {"op": "query", "nonce": nonce, "query": query, "args": args})
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(nonce, None)
+
+    async def _broadcast(self, origin, message):
+        results = await asyncio.gather(*(self._query(writer, message["query"], message["args"]) for writer in list(self.clusters.values())),
+                                       return_exceptions=True)
+        try:
+            await send(origin, {"op": "reply", "nonce": message["nonce"],
+                                "result": [result for result in results if not isinstance(result, Exception)]})
+        except ConnectionError:
+            pass
+
+
+class ClusterClient:
+    """
+    Link of a bot process to the coordinator.
+    Without a cluster id the bot runs alone and every query is answered by this process.
+    """
+
+    def __init__(self, bot, cluster_id=None, host=CLUSTER_HOST, port=CLUSTER_PORT):
+        self.bot = bot
+        self.cluster_id = cluster_id
+        self.host = host
+        self.port = port
+        self.handlers = {}
+        self._writer = None
+        self._pending = {}
+        self._nonces = itertools.count()
+        self._tasks = []
+
+    @property
+    def is_primary(self):
+        """Only the primary cluster reports the global counts."""
+        return self.cluster_id in (None, 0)
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    def register(self, query, handler):
+        """handler is a coroutine function answering a query broadcasted to every cluster."""
+        self.handlers[query] = handler
+
+    def start(self):
+        if self.cluster_id is not None:
+            self._tasks = [self.bot.loop.create_task(self._run()), self.bot.loop.create_task(self._publish())]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def counts(self):
+        return {
+            "guild_count": len(self.bot.guilds),
+            "user_count": len(self.bot.users),
+            "voice_count": len(self.bot.voice_clients)
+        }
+
+    async def _run(self):
+        while not self.bot.is_closed():
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                await send(writer, {"op": "identify", "cluster_id": self.cluster_id})
+                if self.bot.is_ready():
+                    await send(writer, {"op": "ready"})
+                    await send(writer, {"op": "counts", "counts": self.counts()})
+                self._writer = writer
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    if message["op"] == "query":
+                        asyncio.ensure_future(self._answer(message))
+                    elif message["op"] == "reply":
+                        future = self._pending.pop(message["nonce"], None)
+                        if future is not None and not future.done():
+                            future.set_result(message["result"])
+            except (OSError, ValueError) as e:
+                logger.warning(f"Cluster {self.cluster_id} lost the coordinator: {e!r}")
+            self._writer = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost the coordinator"))
+            self._pending.clear()
+            await asyncio.sleep(5)
+
+    async def _publish(self):
+        await self.bot.wait_until_ready()
+        if self._writer is not None:
+            await send(self._writer, {"op": "ready"})
+        while not self.bot.is_closed():
+            if self._writer is not None:
+                try:
+                    await send(self._writer, {"op": "counts", "counts": self.counts()})
+                except ConnectionError:
+                    pass
+            await asyncio.sleep(COUNTS_INTERVAL)
+
+    async def _answer(self, message):
+        """Always reply, the coordinator would otherwise wait for this cluster until the timeout."""
+        handler = self.handlers.get(message["query"])
+        if handler is None:
+            result = {"error": f"Unknown query {message['query']}"}
+        else:
+            try:
+                result = await handler(**message["args"])
+            except Exception as e:
+                logger.exception(f"Cluster {self.cluster_id} failed to answer {message['query']}")
+                result = {"error": repr(e)}
+        try:
+            await send(self._writer, {"op": "reply", "nonce": message["nonce"], "result": result})
+        except (AttributeError, ConnectionError):
+            pass
+
+    async def request(self, op, **message):
+        nonce = next(self._nonces)
+        future = self._pending[nonce] = self.bot.loop.create_future()
+        try:
+            await send(self._writer, {"op": op, "nonce": nonce, **message})
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(nonce, None)
+
+    async def totals(self):
+        """Guild, user and voice counts of every cluster, the counts of this process if the coordinator cannot answer."""
+        if self.connected:
+            try:
+                return await self.request("totals")
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                logger.warning(f"Unable to get the cluster totals: {e!r}")
+        return dict(self.counts(), cluster_count=1)
+
+    async def broadcast(self, query, **args):
+        """Answers of every cluster to the query, a cluster failing to answer gives {"error": reason}."""
+        if not self.connected:
+            return [await self.handlers[query](**args)]
+        return await self.request("broadcast", query=query, args=args)
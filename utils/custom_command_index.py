@@ -0,0 +1,116 @@
+import os
+import time
+from collections import OrderedDict
+
+from utils import db
+
+
+class CustomCommandIndex:
+    """
+    In-memory index of the custom commands of each guild, loaded lazily.
+    Guilds without custom commands and recently rejected names are remembered,
+    so unknown commands never reach the database.
+    Everything is reloaded after ttl seconds, custom commands can be created on the website.
+    """
+
+    def __init__(self, max_guilds=5000, max_empty_guilds=50000, max_unknown_per_guild=200, ttl=int(os.getenv("GUILD_CONFIG_TTL", 600))):
+        self.max_guilds = max_guilds
+        self.max_empty_guilds = max_empty_guilds
+        self.max_unknown_per_guild = max_unknown_per_guild
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        # Guild ID -> (name -> value, monotonic load time)
+        self._commands = OrderedDict()
+        # Guild ID -> monotonic load time
+        self._empty_guilds = OrderedDict()
+        # Guild ID -> (names recently rejected, since), consulted before reloading a guild evicted from the index
+        self._unknown = OrderedDict()
+
+    def _fresh(self, loaded_at):
+        return time.monotonic() - loaded_at < self.ttl
+
+    async def get(self, guild_id, name):
+        """Return the value of the custom command or None."""
+        unknown = self._unknown.get(guild_id)
+        if unknown is not None and name in unknown[0] and self._fresh(unknown[1]):
+            self.misses += 1
+            return None
+        commands = await self.get_all(guild_id)
+        value = commands.get(name)
+        if value is None:
+            self.misses += 1
+            unknown = self._unknown.get(guild_id)
+            if unknown is None or not self._fresh(unknown[1]) or len(unknown[0]) >= self.max_unknown_per_guild:
+                unknown = self._unknown[guild_id] = (set(), time.monotonic())
+            unknown[0].add(name)
+            self._unknown.move_to_end(guild_id)
+            while len(self._unknown) > self.max_guilds:
+                self._unknown.popitem(last=False)
+        else:
+            self.hits += 1
+        return value
+
+    async def get_all(self, guild_id):
+        """Return a dict of name -> value of all the custom commands of the guild."""
+        loaded_at = self._empty_guilds.get(guild_id)
+        if loaded_at is not None and self._fresh(loaded_at):
+            return {}
+        entry = self._commands.get(guild_id)
+        if entry is not None and self._fresh(entry[1]):
+            self._commands.move_to_end(guild_id)
+            return entry[0]
+        self.loads += 1
+        commands = await db.get_custom_commands(guild_id)
+        self.set(guild_id, commands)
+        return commands
+
+    def set(self, guild_id, commands, loaded_at=None):
+        """Replace the commands of a guild with a dict of name -> value."""
+        if loaded_at is None:
+            loaded_at = time.monotonic()
+        self._unknown.pop(guild_id, None)
+        if commands:
+            self._empty_guilds.pop(guild_id, None)
+            self._commands[guild_id] = (commands, loaded_at)
+            self._commands.move_to_end(guild_id)
+            while len(self._commands) > self.max_guilds:
+                self._commands.popitem(last=False)
+        else:
+            self._commands.pop(guild_id, None)
+            self._empty_guilds[guild_id] = loaded_at
+            self._empty_guilds.move_to_end(guild_id)
+            while len(self._empty_guilds) > self.max_empty_guilds:
+                self._empty_guilds.popitem(last=False)
+
+    def put(self, guild_id, name, value):
+        unknown = self._unknown.get(guild_id)
+        if unknown is not None:
+            unknown[0].discard(name)
+        entry = self._commands.get(guild_id)
+        if entry is not None:
+            entry[0][name] = value
+        elif guild_id in self._empty_guilds:
+            self._commands[guild_id] = ({name: value}, self._empty_guilds.pop(guild_id))
+
+    def remove(self, guild_id, name):
+        entry = self._commands.get(guild_id)
+        if entry is not None:
+            entry[0].pop(name, None)
+            if not entry[0]:
+                self.set(guild_id, {}, entry[1])
+
+    def invalidate(self, guild_id):
+        self._commands.pop(guild_id, None)
+        self._empty_guilds.pop(guild_id, None)
+        self._unknown.pop(guild_id, None)
+
+    def stats(self):
+        return {
+            "custom_command_index_guilds": len(self._commands),
+            "custom_command_index_empty_guilds": len(self._empty_guilds),
+            "custom_command_index_hits": self.hits,
+            "custom_command_index_misses": self.misses,
+            "custom_command_index_loads": self.loads
+        }
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.db import close_old_connections
+from lbwebsite.models import GuildServer, GuildPrefix, GuildCustomCommand, GuildSetting, GuildRank, Character, RealmConnected
+from social_django.models import UserSocialAuth
+
+from utils import tracing
+from utils.metrics import metrics
+
+# Every thread of the pool keeps its own Django connection, bounded by the pool size.
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("DB_POOL_SIZE", 4)), thread_name_prefix="db")
+
+
+def _run(func, *args, **kwargs):
+    close_old_connections()
+    return func(*args, **kwargs)
+
+
+async def run(func, *args, **kwargs):
+    """Run a function doing ORM queries on the database thread pool."""
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+    try:
+        with tracing.timed("orm"):
+            return await loop.run_in_executor(executor, partial(_run, func, *args, **kwargs))
+    finally:
+        metrics.timing("legendarybot_db", time.perf_counter() - start)
+
+
+async def get_guild_prefixes(guild_id):
+    return await run(lambda: [prefix.prefix for prefix in GuildPrefix.objects.filter(guild_id=guild_id).all()])
+
+
+async def get_guilds_prefixes(guild_ids):
+    """Prefixes of multiple guilds, as a dict of guild id -> list of prefixes."""
+    def query():
+        prefixes = {guild_id: [] for guild_id in guild_ids}
+        for prefix in GuildPrefix.objects.filter(guild_id__in=guild_ids).all():
+            prefixes[prefix.guild_id].append(prefix.prefix)
+        return prefixes
+    return await run(query)
+
+
+async def add_guild_prefix(guild_id, prefix):
+    """Add the prefix to the guild. Returns False if the prefix was already set."""
+    def query():
+        if GuildPrefix.objects.filter(guild_id=guild_id, prefix=prefix).exists():
+            return False
+        GuildPrefix(guild_id=guild_id, prefix=prefix).save()
+        return True
+    return await run(query)
+
+
+async def remove_guild_prefix(guild_id, prefix):
+    """Remove the prefix from the guild. Returns False if the prefix was not set."""
+    def query():
+        prefix_entry = GuildPrefix.objects.filter(guild_id=guild_id, prefix=prefix).first()
+        if not prefix_entry:
+            return False
+        prefix_entry.delete()
+        return True
+    return await run(query)
+
+
+async def get_custom_commands(guild_id):
+    return await run(lambda: {command.name: command.value for command in GuildCustomCommand.objects.filter(guild_id=guild_id).all()})
+
+
+async def set_custom_command(guild_id, name, value):
+    """Create or update a text custom command. Returns True if the command was created."""
+    def query():
+        custom_command = GuildCustomCommand.objects.filter(guild_id=guild_id, name=name).first()
+        created = custom_command is None
+        if created:
+            custom_command = GuildCustomCommand(guild_id=guild_id, name=name)
+        custom_command.type = GuildCustomCommand.TEXT
+        custom_command.value = value
+        custom_command.save()
+        return created
+    return await run(query)
+
+
+async def remove_custom_command(guild_id, name):
+    """Remove a custom command. Returns False if the command did not exist."""
+    def query():
+        custom_command = GuildCustomCommand.objects.filter(guild_id=guild_id, name=name).first()
+        if not custom_command:
+            return False
+        custom_command.delete()
+        return True
+    return await run(query)
+
+
+async def get_guild_settings(setting_name):
+    return await run(lambda: list(GuildSetting.objects.filter(setting_name=setting_name).select_related('guild').all()))
+
+
+async def get_configured_guilds():
+    """Ids of the guilds having at least one setting or custom prefix."""
+    def query():
+        guild_ids = set(GuildSetting.objects.values_list('guild_id', flat=True).distinct())
+        guild_ids.update(GuildPrefix.objects.values_list('guild_id', flat=True).distinct())
+        return guild_ids
+    return await run(query)
+
+
+async def get_main_character(guild_id, user_id):
+    def query():
+        user_social = UserSocialAuth.objects.filter(provider='discord', uid=user_id).first()
+        if user_social:
+            return Character.objects.filter(user_id=user_social.user_id, main_for_guild=guild_id).first()
+        return None
+    return await run(query)
+
+
+async def get_main_characters(guild_id):
+    """
+    Map the Discord user ID of every user having a main character in the guild to that character.
+    Runs 2 queries whatever the size of the guild.
+    """
+    def query():
+        characters = {}
+        for character in Character.objects.filter(main_for_guild=guild_id).all():
+            characters.setdefault(character.user_id, character)
+        main_characters = {}
+        for user_social in UserSocialAuth.objects.filter(provider='discord', user_id__in=list(characters.keys())).all():
+            main_characters.setdefault(int(user_social.uid), characters[user_social.user_id])
+        return main_characters
+    return await run(query)
+
+
+async def get_connected_realms():
+    """The connected realm graph, as a dict of (server slug, region) -> connected realm slugs."""
+    def query():
+        connected_realms = {}
+        for realm in RealmConnected.objects.prefetch_related('connected_realm').all():
+            connected_realms[(realm.server_slug, realm.region)] = [realm_entry.server_slug for realm_entry in realm.connected_realm.all()]
+        return connected_realms
+    return await run(query)
+
+
+async def get_connected_realm_slugs(server_slug):
+    def query():
+        realm = RealmConnected.objects.filter(server_slug=server_slug).first()
+        if realm:
+            return [realm_entry.server_slug for realm_entry in realm.connected_realm.all()]
+        return []
+    return await run(query)
+
+
+async def get_guild_config(guild_id):
+    """Everything the cogs need to know about a guild, loaded in a single trip to the pool."""
+    def query():
+        return {
+            "default_server": GuildServer.objects.filter(guild_id=guild_id, default=True).first(),
+            "prefixes": [prefix.prefix for prefix in GuildPrefix.objects.filter(guild_id=guild_id).all()],
+            "settings": {setting.setting_name: setting for setting in GuildSetting.objects.filter(guild=guild_id).select_related('guild').all()},
+            "ranks": list(GuildRank.objects.filter(guild=guild_id).select_related('wow_guild').all()),
+            "custom_commands": {command.name: command.value for command in GuildCustomCommand.objects.filter(guild_id=guild_id).all()},
+        }
+    return await run(query)
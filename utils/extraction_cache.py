@@ -0,0 +1,105 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+METADATA_TTL = int(os.getenv("EXTRACTION_METADATA_TTL", 7*24*60*60))
+STREAM_TTL = int(os.getenv("EXTRACTION_STREAM_TTL", 6*60*60))
+
+YOUTUBE_ID = re.compile(r"^[\w-]{11}$")
+
+
+def normalize(query):
+    """Cache key of a search query or URL. YouTube URLs of the same video share the same key."""
+    query = " ".join(query.split())
+    parts = urlsplit(query)
+    host = parts.netloc.lower()
+    if host.startswith("www.") or host.startswith("m."):
+        host = host.split(".", 1)[1]
+    video_id = None
+    if host == "youtu.be":
+        video_id = parts.path.lstrip("/")
+    elif host in ("youtube.com", "music.youtube.com") and parts.path == "/watch":
+        video_id = parse_qs(parts.query).get("v", [None])[0]
+    if video_id and YOUTUBE_ID.match(video_id):
+        return f"youtube:{video_id}"
+    if parts.scheme in ("http", "https"):
+        return query
+    return query.lower()
+
+
+class ExtractionCache:
+    """
+    youtube_dl extraction results, keyed by normalized query or URL.
+    The metadata of a track (title, webpage_url, duration) lives for days,
+    its stream URL only until the expire time the URL was given.
+    """
+
+    def __init__(self, max_size=5000, metadata_ttl=METADATA_TTL, stream_ttl=STREAM_TTL):
+        self.max_size = max_size
+        self.metadata_ttl = metadata_ttl
+        self.stream_ttl = stream_ttl
+        self.hits = 0
+        self.stream_hits = 0
+        self.misses = 0
+        # Normalized query -> webpage_url
+        self._queries = OrderedDict()
+        # webpage_url -> [metadata, metadata expiry, stream url, stream expiry]
+        self._tracks = OrderedDict()
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def lookup(self, query):
+        """Metadata of the track the query led to, with its stream URL if it has not expired."""
+        key = normalize(query)
+        webpage_url = self._queries.get(key)
+        track = self._tracks.get(webpage_url) if webpage_url else None
+        now = time.time()
+        if track is None or track[1] < now:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._queries.move_to_end(key)
+        self._tracks.move_to_end(webpage_url)
+        result = dict(track[0])
+        if track[2] and track[3] > now:
+            self.stream_hits += 1
+            result.update({"stream_url": track[2], "expires_at": track[3]})
+        return result
+
+    def stream(self, webpage_url):
+        """(stream url, expiry) of the track, None if it is unknown or expired."""
+        track = self._tracks.get(webpage_url)
+        if track is None or not track[2] or track[3] < time.time():
+            return None
+        self.stream_hits += 1
+        return track[2], track[3]
+
+    def store(self, query, metadata, stream_url=None, expires_at=None):
+        webpage_url = metadata["webpage_url"]
+        now = time.time()
+        if stream_url:
+            expires_at = min(expires_at or now + self.stream_ttl, now + self.stream_ttl)
+        self._tracks[webpage_url] = [metadata, now + self.metadata_ttl, stream_url, expires_at or 0]
+        self._tracks.move_to_end(webpage_url)
+        for key in {normalize(query), normalize(webpage_url)}:
+            self._queries[key] = webpage_url
+            self._queries.move_to_end(key)
+        while len(self._tracks) > self.max_size:
+            self._tracks.popitem(last=False)
+        # Queries pointing to evicted tracks are dropped lazily, they only need to stay bounded
+        while len(self._queries) > self.max_size * 2:
+            self._queries.popitem(last=False)
+
+    def stats(self):
+        return {
+            "extraction_cache_size": len(self._tracks),
+            "extraction_cache_hits": self.hits,
+            "extraction_cache_stream_hits": self.stream_hits,
+            "extraction_cache_misses": self.misses
+        }
+
+
+extractions = ExtractionCache()
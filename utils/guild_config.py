@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+
+from utils import db
+from utils.single_flight import SingleFlight
+from utils.snapshot import age_of, loaded_at_of
+
+
+class GuildConfig:
+    """In-memory snapshot of the configuration of a Discord guild."""
+
+    __slots__ = ('guild_id', 'default_server', 'prefixes', 'settings', 'ranks', 'custom_commands', 'loaded_at')
+
+    def __init__(self, guild_id, default_server, prefixes, settings, ranks, custom_commands):
+        self.guild_id = guild_id
+        self.default_server = default_server
+        self.prefixes = prefixes
+        self.settings = settings
+        self.ranks = ranks
+        self.custom_commands = custom_commands
+        self.loaded_at = time.monotonic()
+
+    @property
+    def region(self):
+        if self.default_server:
+            return self.default_server.get_region_display()
+        return None
+
+    def get_setting(self, setting_name):
+        return self.settings.get(setting_name)
+
+    def copy(self):
+        """Copy not sharing the containers the bot modifies, custom_commands is shared with the CustomCommandIndex."""
+        config = GuildConfig(self.guild_id, self.default_server, list(self.prefixes), dict(self.settings), list(self.ranks), dict(self.custom_commands))
+        config.loaded_at = self.loaded_at
+        return config
+
+
+class GuildConfigCache:
+    """
+    Keeps the GuildConfig of every guild in memory for ttl seconds.
+    Anything modifying the configuration from the bot must call invalidate().
+    """
+
+    def __init__(self, bot, ttl=int(os.getenv("GUILD_CONFIG_TTL", 600))):
+        self.bot = bot
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._configs = {}
+        self._loading = SingleFlight()
+
+    def __len__(self):
+        return len(self._configs)
+
+    async def get(self, guild_id):
+        config = self._configs.get(guild_id)
+        if config is not None and time.monotonic() - config.loaded_at < self.ttl:
+            self.hits += 1
+            return config
+        self.misses += 1
+        return await self.load(guild_id)
+
+    async def load(self, guild_id):
+        # Concurrent loads of the same guild share the same queries
+        return await self._loading.run(guild_id, lambda: self._load(guild_id))
+
+    async def _load(self, guild_id):
+        config = GuildConfig(guild_id, **await db.get_guild_config(guild_id))
+        self._configs[guild_id] = config
+        self.bot.prefix_cache.set(guild_id, config.prefixes)
+        self.bot.custom_command_index.set(guild_id, config.custom_commands)
+        return config
+
+    async def warm(self, guild_ids):
+        """Load the configuration of the given guilds not cached yet."""
+        await asyncio.gather(*(self.load(guild_id) for guild_id in guild_ids if guild_id not in self._configs), return_exceptions=True)
+
+    def snapshot(self):
+        return {guild_id: (config.copy(), age_of(config.loaded_at)) for guild_id, config in self._configs.items()}
+
+    def restore(self, state, elapsed):
+        for guild_id, (config, age) in state.items():
+            if age + elapsed < self.ttl and guild_id not in self._configs:
+                config.loaded_at = loaded_at_of(age, elapsed)
+                self._configs[guild_id] = config
+                self.bot.prefix_cache.set(guild_id, config.prefixes, config.loaded_at)
+                self.bot.custom_command_index.set(guild_id, config.custom_commands, config.loaded_at)
+
+    def invalidate(self, guild_id):
+        self._configs.pop(guild_id, None)
+
+    def stats(self):
+        return {
+            "guild_config_cache_size": len(self._configs),
+            "guild_config_cache_hits": self.hits,
+            "guild_config_cache_misses": self.misses
+        }
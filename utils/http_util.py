@@ -0,0 +1,84 @@
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils import tracing
+
+DEFAULT_TIMEOUT = 10
+
+SERVICES = {
+    "raider.io": "raiderio",
+    "www.warcraftlogs.com": "warcraftlogs",
+    "data.wowtoken.info": "wowtoken"
+}
+
+
+class Response:
+    """
+    Result of an HTTP request, read completely so it can outlive the connection.
+    Mimics the small part of requests.Response used by the cogs.
+    """
+
+    __slots__ = ('status', 'headers', '_json')
+
+    def __init__(self, status, json=None, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self._json = json
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    def json(self):
+        return self._json
+
+    def header(self, name):
+        """Case insensitive header lookup."""
+        name = name.lower()
+        for header, value in self.headers.items():
+            if header.lower() == name:
+                return value
+        return None
+
+
+def create_session(limit=20, keepalive_timeout=60, timeout=DEFAULT_TIMEOUT):
+    connector = aiohttp.TCPConnector(limit=limit, keepalive_timeout=keepalive_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def read_response(response):
+    json = None
+    if response.status < 400:
+        try:
+            json = await response.json(content_type=None)
+        except ValueError:
+            pass
+    return Response(response.status, json, dict(response.headers))
+
+
+__session = None
+
+
+def get_session():
+    """Shared session used for the non Battle.net APIs (Raider.IO, WarcraftLogs, wowtoken.info...)."""
+    global __session
+    if __session is None or __session.closed:
+        __session = create_session()
+    return __session
+
+
+def service_name(url):
+    host = urlsplit(url).hostname
+    return SERVICES.get(host, host)
+
+
+async def get(url, params=None, timeout=DEFAULT_TIMEOUT):
+    with tracing.timed(f"http:{service_name(url)}"):
+        async with get_session().get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            return await read_response(response)
+
+
+async def close():
+    if __session is not None:
+        await __session.close()
@@ -0,0 +1,50 @@
+import logging
+import time
+from logging.handlers import QueueHandler
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler leaving the Formatter work (timestamp, level, traceback) to the listener thread.
+    The message itself is merged with its args on the calling thread before being queued,
+    the args can be objects the loop keeps modifying.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let at most rate records with the same message template through every per seconds.
+    The first record of the next window reports how many were suppressed.
+    Only useful with lazy %-style messages, an f-string gives every record its own template.
+    """
+
+    def __init__(self, rate=20, per=60):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.suppressed = 0
+        # Message template -> [window start, records let through, records suppressed]
+        self._windows = {}
+
+    def filter(self, record):
+        key = record.msg
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.per:
+            if len(self._windows) >= 10000:
+                self._windows.clear()
+            self._windows[key] = [now, 1, 0]
+            if window is not None and window[2]:
+                record.msg = f"{record.msg} [{window[2]} similar messages suppressed]"
+            return True
+        if window[1] < self.rate:
+            window[1] += 1
+            return True
+        window[2] += 1
+        self.suppressed += 1
+        return False
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from utils.metrics import Histogram
+
+logger = logging.getLogger("legendarybot.loop")
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping for a fixed interval.
+    A watchdog thread logs the stack of the loop thread when a callback holds the loop longer than the threshold.
+    """
+
+    def __init__(self, loop, interval=float(os.getenv("LOOP_MONITOR_INTERVAL", 0.25)),
+                 threshold=float(os.getenv("LOOP_BLOCKED_THRESHOLD", 0.5))):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked_count = 0
+        self.lags = Histogram()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._reported = False
+        self._stop = threading.Event()
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        if self._task is None:
+            self._task = self.loop.create_task(self._probe())
+            self._thread = threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._stop.set()
+            self._task = None
+
+    async def _probe(self):
+        self._loop_thread_id = threading.get_ident()
+        while True:
+            self._heartbeat = time.monotonic()
+            self._reported = False
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.add(max(self.loop.time() - start - self.interval, 0.0))
+
+    def _watchdog(self):
+        while not self._stop.wait(self.interval):
+            if self._loop_thread_id is None or self._reported:
+                continue
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked > self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                self._reported = True
+                self.blocked_count += 1
+                stack = "".join(traceback.format_stack(frame))
+                logger.warning(f"Event loop blocked for more than {blocked:.3f}s. Loop thread stack:\n{stack}")
+
+    def stats(self):
+        """Lag percentiles since the last call."""
+        lags, self.lags = self.lags, Histogram()
+        stats = {"loop_blocked_count": self.blocked_count}
+        if lags.count:
+            stats.update({f"loop_lag_{name}": value for name, value in lags.fields().items()})
+        return stats
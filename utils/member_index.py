@@ -0,0 +1,46 @@
+class MemberIndex:
+    """
+    Reverse index of the cached members, user id -> ids of the guilds of this process they are a member of.
+    Only as complete as the member cache, offline members of large guilds are only known once chunked.
+    """
+
+    def __init__(self):
+        self._guilds = {}
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def add(self, user_id, guild_id):
+        guilds = self._guilds.get(user_id)
+        if guilds is None:
+            self._guilds[user_id] = {guild_id}
+        else:
+            guilds.add(guild_id)
+
+    def remove(self, user_id, guild_id):
+        guilds = self._guilds.get(user_id)
+        if guilds is not None:
+            guilds.discard(guild_id)
+            if not guilds:
+                del self._guilds[user_id]
+
+    def add_guild(self, guild):
+        for member in guild.members:
+            self.add(member.id, guild.id)
+
+    def remove_guild(self, guild):
+        for member in guild.members:
+            self.remove(member.id, guild.id)
+
+    def rebuild(self, guilds):
+        self._guilds = {}
+        for guild in guilds:
+            self.add_guild(guild)
+
+    def guilds_of(self, user_id):
+        return frozenset(self._guilds.get(user_id, ()))
+
+    def stats(self):
+        return {
+            "member_index_users": len(self._guilds)
+        }
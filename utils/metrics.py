@@ -0,0 +1,180 @@
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+FLUSH_INTERVAL = int(os.getenv("METRICS_FLUSH_INTERVAL", 10))
+MAX_BACKLOG = int(os.getenv("METRICS_MAX_BACKLOG", 50000))
+BATCH_SIZE = 5000
+SAMPLE_SIZE = 1024
+
+
+def _escape(value):
+    return str(value).replace(",", "\\,").replace(" ", "\\ ").replace("=", "\\=")
+
+
+def _field(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def to_line(measurement, tags, fields, timestamp):
+    """
+    Format a point in the InfluxDB line protocol, timestamp in nanoseconds.
+    InfluxDB rejects inf and nan, those fields are left out. None if no field is left.
+    """
+    fields = {name: value for name, value in fields.items() if not isinstance(value, float) or math.isfinite(value)}
+    if not fields:
+        return None
+    line = _escape(measurement)
+    for name, value in sorted(tags.items()):
+        line += f",{_escape(name)}={_escape(value)}"
+    line += " " + ",".join(f"{_escape(name)}={_field(value)}" for name, value in fields.items())
+    return f"{line} {timestamp}"
+
+
+class Histogram:
+    """Count, sum and extremes of the recorded values plus a bounded sample to compute percentiles."""
+
+    __slots__ = ('count', 'total', 'min', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = []
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append(value)
+        else:
+            # Reservoir sampling, every value of the interval has the same chance to be in the sample
+            index = random.randrange(self.count)
+            if index < SAMPLE_SIZE:
+                self.samples[index] = value
+
+    def percentile(self, percent):
+        samples = sorted(self.samples)
+        return samples[min(int(len(samples) * percent / 100), len(samples) - 1)]
+
+    def fields(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": float(self.min),
+            "max": float(self.max),
+            "p50": float(self.percentile(50)),
+            "p95": float(self.percentile(95)),
+            "p99": float(self.percentile(99))
+        }
+
+
+class Metrics:
+    """
+    Collects counters, histograms and points in memory and writes them to InfluxDB in batches.
+    Recording only touches in-memory structures, the aggregation and the writes happen in a background thread.
+    When InfluxDB is unreachable, the lines are kept in a bounded backlog and the oldest ones are dropped.
+    """
+
+    def __init__(self, database="legendarybot", flush_interval=FLUSH_INTERVAL, max_backlog=MAX_BACKLOG):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.backlog = deque(maxlen=max_backlog)
+        self.dropped = 0
+        self._counters = defaultdict(int)
+        self._histograms = {}
+        self._points = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._client = None
+
+    def increment(self, measurement, value=1, **tags):
+        key = (measurement, tuple(sorted(tags.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def timing(self, measurement, value, **tags):
+        key = (measurement, tuple(sorted(tags.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.add(value)
+
+    def point(self, measurement, fields, **tags):
+        with self._lock:
+            self._points.append((measurement, tags, fields, time.time_ns()))
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def _collect(self):
+        with self._lock:
+            counters, self._counters = self._counters, defaultdict(int)
+            histograms, self._histograms = self._histograms, {}
+            points, self._points = self._points, []
+        now = time.time_ns()
+        lines = [to_line(measurement, tags, fields, timestamp) for measurement, tags, fields, timestamp in points]
+        for (measurement, tags), value in counters.items():
+            lines.append(to_line(measurement, dict(tags), {"count": value}, now))
+        for (measurement, tags), histogram in histograms.items():
+            lines.append(to_line(measurement, dict(tags), histogram.fields(), now))
+        return [line for line in lines if line is not None]
+
+    def flush(self):
+        lines = self._collect()
+        if len(self.backlog) + len(lines) > self.backlog.maxlen:
+            self.dropped += len(self.backlog) + len(lines) - self.backlog.maxlen
+        self.backlog.extend(lines)
+        if not self.backlog:
+            return
+        if self._client is None:
+            # Imported by the flush thread, it is slow to import and only needed there
+            from influxdb import InfluxDBClient
+            self._client = InfluxDBClient(database=self.database, gzip=True)
+        from influxdb.exceptions import InfluxDBClientError
+        while self.backlog:
+            batch = [self.backlog.popleft() for _ in range(min(BATCH_SIZE, len(self.backlog)))]
+            try:
+                self._client.write_points(batch, protocol='line', time_precision='n')
+            except InfluxDBClientError as e:
+                # A 4xx answer will not change on retry, keeping the batch would block every line behind it
+                self.dropped += len(batch)
+                logging.warning(f"InfluxDB rejected {len(batch)} metric lines, dropping them: {e!r}")
+            except Exception as e:
+                self.backlog.extendleft(reversed(batch))
+                logging.warning(f"Unable to write {len(self.backlog)} metric lines to InfluxDB, keeping them for the next flush: {e!r}")
+                return
+
+
+metrics = Metrics()
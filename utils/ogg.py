@@ -0,0 +1,36 @@
+"""Minimal Ogg demuxer, enough to forward the Opus packets written by ffmpeg to Discord without decoding them."""
+
+PAGE_HEADER_SIZE = 27
+
+
+def iter_pages(stream):
+    """(segment table, body) of every page read from a binary file object."""
+    while True:
+        header = stream.read(PAGE_HEADER_SIZE)
+        if len(header) < PAGE_HEADER_SIZE:
+            return
+        if header[:4] != b'OggS':
+            raise ValueError("Not an Ogg page")
+        segment_table = stream.read(header[26])
+        body = stream.read(sum(segment_table))
+        yield segment_table, body
+
+
+def iter_packets(stream):
+    """Packets of the stream, a packet ends with the first segment shorter than 255 bytes and can span pages."""
+    packet = b''
+    for segment_table, body in iter_pages(stream):
+        offset = 0
+        for size in segment_table:
+            packet += body[offset:offset + size]
+            offset += size
+            if size < 255:
+                yield packet
+                packet = b''
+
+
+def iter_opus_packets(stream):
+    """Audio packets of an Ogg Opus stream, the OpusHead and OpusTags headers are skipped."""
+    for packet in iter_packets(stream):
+        if not packet.startswith((b'OpusHead', b'OpusTags')):
+            yield packet
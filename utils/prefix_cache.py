@@ -0,0 +1,91 @@
+import os
+import time
+from collections import OrderedDict
+
+from utils import db
+from utils.single_flight import SingleFlight
+from utils.snapshot import age_of, loaded_at_of
+
+
+class PrefixCache:
+    """
+    LRU cache of the custom prefixes of each guild, keyed by guild id.
+    An empty list means the guild is known to have no custom prefix.
+    Entries are reloaded after ttl seconds, prefixes can be edited on the website.
+    """
+
+    def __init__(self, max_size=10000, ttl=int(os.getenv("GUILD_CONFIG_TTL", 600))):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Guild ID -> (prefixes, monotonic load time)
+        self._prefixes = OrderedDict()
+        self._loading = SingleFlight()
+
+    def __len__(self):
+        return len(self._prefixes)
+
+    def __contains__(self, guild_id):
+        return guild_id in self._prefixes
+
+    async def get(self, guild_id):
+        entry = self._prefixes.get(guild_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            self._prefixes.move_to_end(guild_id)
+            return entry[0]
+        self.misses += 1
+        return await self.load(guild_id)
+
+    async def load(self, guild_id):
+        # Concurrent misses of the same guild share the same query
+        return await self._loading.run(guild_id, lambda: self._load(guild_id))
+
+    async def _load(self, guild_id):
+        prefixes = await db.get_guild_prefixes(guild_id)
+        self.set(guild_id, prefixes)
+        return self._prefixes[guild_id][0]
+
+    def set(self, guild_id, prefixes, loaded_at=None):
+        self._prefixes[guild_id] = (list(prefixes), loaded_at if loaded_at is not None else time.monotonic())
+        self._prefixes.move_to_end(guild_id)
+        while len(self._prefixes) > self.max_size:
+            self._prefixes.popitem(last=False)
+
+    def add(self, guild_id, prefix):
+        if guild_id in self._prefixes:
+            prefixes = self._prefixes[guild_id][0]
+            if prefix not in prefixes:
+                prefixes.append(prefix)
+
+    def remove(self, guild_id, prefix):
+        if guild_id in self._prefixes:
+            try:
+                self._prefixes[guild_id][0].remove(prefix)
+            except ValueError:
+                pass
+
+    def invalidate(self, guild_id):
+        self._prefixes.pop(guild_id, None)
+
+    async def warm(self, guild_ids):
+        """Load the prefixes of the given guilds with a single query."""
+        prefixes = await db.get_guilds_prefixes(list(guild_ids)[:self.max_size])
+        for guild_id, guild_prefixes in prefixes.items():
+            self.set(guild_id, guild_prefixes)
+
+    def snapshot(self):
+        return {guild_id: (list(prefixes), age_of(loaded_at)) for guild_id, (prefixes, loaded_at) in self._prefixes.items()}
+
+    def restore(self, state, elapsed):
+        for guild_id, (prefixes, age) in state.items():
+            if age + elapsed < self.ttl and guild_id not in self._prefixes:
+                self.set(guild_id, prefixes, loaded_at_of(age, elapsed))
+
+    def stats(self):
+        return {
+            "prefix_cache_size": len(self._prefixes),
+            "prefix_cache_hits": self.hits,
+            "prefix_cache_misses": self.misses
+        }
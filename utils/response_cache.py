@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict, defaultdict
+
+from django.core.cache import cache as django_cache
+
+from utils import battlenet_util, http_util
+from utils.metrics import metrics
+from utils.single_flight import SingleFlight
+
+# Namespace: (fresh for, served stale while revalidating for) in seconds
+TTLS = {
+    "token": (10*60, 60*60),
+    "affix": (60*60, 24*60*60),
+    "realm": (24*60*60, 7*24*60*60),
+    "realm_status": (60, 5*60),
+    "raiderio_character": (10*60, 60*60),
+    "raiderio_season": (24*60*60, 7*24*60*60),
+    "raiderio_guild": (30*60, 2*60*60),
+    "battlenet_character": (10*60, 60*60),
+    "warcraftlogs_reports": (5*60, 30*60),
+    "warcraftlogs_zones": (24*60*60, 7*24*60*60),
+}
+
+
+class LocalBackend:
+    """In-process LRU storage."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at, stale_until = entry
+        if stale_until < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value, expires_at
+
+    def set(self, key, value, expires_at, stale_until):
+        self._entries[key] = (value, expires_at, stale_until)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def snapshot(self):
+        now = time.time()
+        return [(key, *entry) for key, entry in self._entries.items() if entry[2] > now]
+
+    def restore(self, state, elapsed):
+        now = time.time()
+        for key, value, expires_at, stale_until in state:
+            if stale_until > now and key not in self._entries:
+                self.set(key, value, expires_at, stale_until)
+
+
+class DjangoBackend:
+    """Storage on top of the Django cache, shared with anything else using it."""
+
+    def get(self, key):
+        return django_cache.get(key)
+
+    def set(self, key, value, expires_at, stale_until):
+        django_cache.set(key, (value, expires_at), max(int(stale_until - time.time()), 1))
+
+    def snapshot(self):
+        # Already outlives the process
+        return None
+
+    def restore(self, state, elapsed):
+        pass
+
+
+class ResponseCache:
+    """
+    TTL cache for external API responses.
+    Expired entries are still served during their stale window while a single background refresh runs,
+    and concurrent misses for the same key share one upstream request.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._in_flight = SingleFlight()
+        self.metrics = defaultdict(lambda: {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0})
+
+    async def fetch(self, namespace, key, fetch):
+        key = f"{namespace}:{key}"
+        counters = self.metrics[namespace]
+        start = time.perf_counter()
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > time.time():
+                counters["hits"] += 1
+            else:
+                counters["stale_hits"] += 1
+                self._refresh(namespace, key, fetch)
+            metrics.timing("legendarybot_response_cache", time.perf_counter() - start, namespace=namespace, result="hit")
+            return value
+        if key in self._in_flight:
+            counters["coalesced"] += 1
+        else:
+            counters["misses"] += 1
+        try:
+            return await asyncio.shield(self._refresh(namespace, key, fetch))
+        finally:
+            metrics.timing("legendarybot_response_cache", time.perf_counter() - start, namespace=namespace, result="miss")
+
+    def _refresh(self, namespace, key, fetch):
+        return self._in_flight.start(key, lambda: self._run(namespace, key, fetch))
+
+    async def _run(self, namespace, key, fetch):
+        ttl, stale_ttl = TTLS[namespace]
+        try:
+            response = await fetch()
+        except Exception as e:
+            logging.warning(f"Refreshing {key} failed: {e!r}")
+            raise
+        if response.ok:
+            now = time.time()
+            self.backend.set(key, response, now + ttl, now + ttl + stale_ttl)
+        return response
+
+    def snapshot(self):
+        return self.backend.snapshot()
+
+    def restore(self, state, elapsed):
+        self.backend.restore(state, elapsed)
+
+    def stats(self):
+        stats = {}
+        totals = defaultdict(int)
+        for namespace, counters in self.metrics.items():
+            for name, value in counters.items():
+                stats[f"response_cache_{namespace}_{name}"] = value
+                totals[name] += value
+        for name, value in totals.items():
+            stats[f"response_cache_{name}"] = value
+        requests = sum(totals.values())
+        stats["response_cache_hit_rate"] = (totals["hits"] + totals["stale_hits"] + totals["coalesced"]) / requests if requests else 0.0
+        return stats
+
+
+def make_key(url, params=None):
+    if params:
+        url += "?" + "&".join(f"{name}={value}" for name, value in sorted(params.items()))
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+if os.getenv("RESPONSE_CACHE_BACKEND", "local") == "django":
+    cache = ResponseCache(DjangoBackend())
+else:
+    cache = ResponseCache(LocalBackend())
+
+
+async def get(namespace, url, params=None):
+    """Cached version of http_util.get"""
+    return await cache.fetch(namespace, make_key(url, params), lambda: http_util.get(url, params=params))
+
+
+async def battlenet_request(namespace, url, params=None):
+    """Cached version of battlenet_util.execute_battlenet_request"""
+    return await cache.fetch(namespace, make_key(url, params), lambda: battlenet_util.execute_battlenet_request(url, params=params))
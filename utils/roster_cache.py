@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+
+from utils import battlenet_util
+from utils.single_flight import SingleFlight
+from utils.snapshot import age_of, loaded_at_of
+
+ROSTER_TTL = int(os.getenv("ROSTER_TTL", 15*60))
+
+
+class Roster:
+    """Members of a WoW guild indexed by (lowercase realm, character name) -> rank id."""
+
+    __slots__ = ('members', 'etag', 'last_modified', 'fetched_at')
+
+    def __init__(self, members, etag=None, last_modified=None):
+        self.members = members
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.members)
+
+    def rank_of(self, realm, name):
+        return self.members.get((realm.lower(), name))
+
+    @classmethod
+    def from_json(cls, bnet_json, etag=None, last_modified=None):
+        members = {(member['character']['realm'].lower(), member['character']['name']): member['rank'] for member in bnet_json['members']}
+        return cls(members, etag, last_modified)
+
+
+class RosterCache:
+    """
+    Blizzard guild rosters shared by every Discord server syncing with the same WoW guild.
+    Rosters older than the TTL are revalidated with If-None-Match / If-Modified-Since,
+    and the last known roster is kept if Blizzard fails to answer.
+    """
+
+    def __init__(self, ttl=ROSTER_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._rosters = {}
+        self._in_flight = SingleFlight()
+
+    def __len__(self):
+        return len(self._rosters)
+
+    async def get(self, region, realm, guild_name):
+        key = (region.lower(), realm, guild_name)
+        roster = self._rosters.get(key)
+        if roster is not None and time.monotonic() - roster.fetched_at < self.ttl:
+            self.hits += 1
+            return roster
+        self.misses += 1
+        return await self._in_flight.run(key, lambda: self._fetch(key, roster))
+
+    async def _fetch(self, key, roster):
+        region, realm, guild_name = key
+        headers = {}
+        if roster is not None:
+            if roster.etag:
+                headers["If-None-Match"] = roster.etag
+            if roster.last_modified:
+                headers["If-Modified-Since"] = roster.last_modified
+        try:
+            bnet_request = await battlenet_util.execute_battlenet_request(f"https://{region}.api.blizzard.com/wow/guild/{realm}/{guild_name}", params={"fields": "members"}, headers=headers)
+        except Exception as e:
+            logging.warning(f"Unable to fetch the roster of {guild_name}-{realm}-{region}: {e!r}")
+            return roster
+        if bnet_request.status == 304 and roster is not None:
+            self.revalidated += 1
+            roster.fetched_at = time.monotonic()
+            return roster
+        if bnet_request.json() is None:
+            return roster
+        roster = Roster.from_json(bnet_request.json(), bnet_request.header("ETag"), bnet_request.header("Last-Modified"))
+        self._rosters[key] = roster
+        return roster
+
+    def snapshot(self):
+        return {key: (roster, age_of(roster.fetched_at)) for key, roster in self._rosters.items()}
+
+    def restore(self, state, elapsed):
+        # Expired rosters are kept too, they are revalidated with their ETag instead of downloaded again
+        for key, (roster, age) in state.items():
+            if key not in self._rosters:
+                roster.fetched_at = loaded_at_of(age, elapsed)
+                self._rosters[key] = roster
+
+    def invalidate(self, region, realm, guild_name):
+        self._rosters.pop((region.lower(), realm, guild_name), None)
+
+    def stats(self):
+        return {
+            "roster_cache_size": len(self._rosters),
+            "roster_cache_hits": self.hits,
+            "roster_cache_misses": self.misses,
+            "roster_cache_revalidated": self.revalidated
+        }
+
+
+rosters = RosterCache()
@@ -0,0 +1,34 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Runs at most one task per key, concurrent callers of the same key share its result.
+    The task is shielded from its callers, one of them giving up does not cancel it for the others.
+    Its exception is marked as retrieved, a task nobody waits on any more fails silently.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def start(self, key, factory):
+        """Task running factory() for this key, only called if no task is running for it yet."""
+        if key not in self._tasks:
+            task = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda done: self._done(key, done))
+            self._tasks[key] = task
+        return self._tasks[key]
+
+    def _done(self, key, task):
+        self._tasks.pop(key, None)
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, factory):
+        return await asyncio.shield(self.start(key, factory))
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import pickle
+import time
+import zlib
+
+SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "cache_snapshot.bin")
+SNAPSHOT_INTERVAL = int(os.getenv("CACHE_SNAPSHOT_INTERVAL", 5*60))
+# Older snapshots are ignored, the data they hold could have changed on the website since
+SNAPSHOT_MAX_AGE = int(os.getenv("CACHE_SNAPSHOT_MAX_AGE", 60*60))
+VERSION = 2
+
+
+def age_of(loaded_at):
+    """Seconds since a time.monotonic() timestamp, snapshots store ages as monotonic times mean nothing to another process."""
+    return time.monotonic() - loaded_at
+
+
+def loaded_at_of(age, elapsed):
+    """time.monotonic() timestamp of an entry that was age seconds old when the snapshot was taken elapsed seconds ago."""
+    return time.monotonic() - age - elapsed
+
+
+class Snapshot:
+    """
+    Saves the in-memory caches to a compressed pickle and restores them on startup.
+    Every cache gives a snapshot() returning its state and a restore(state, elapsed) taking it back,
+    elapsed being the seconds since the snapshot was taken.
+    snapshot() runs on the loop and must return copies, the state is pickled on another thread.
+    Only load snapshots the bot wrote itself, unpickling runs arbitrary code.
+    The file holds the Battle.net access tokens, it is only readable by its owner.
+    """
+
+    def __init__(self, caches, path=SNAPSHOT_PATH):
+        self.caches = caches
+        self.path = path
+        self._task = None
+
+    def collect(self):
+        return {
+            "version": VERSION,
+            "taken_at": time.time(),
+            "caches": {name: cache.snapshot() for name, cache in self.caches.items()}
+        }
+
+    def write(self, state):
+        data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+        temp_path = f"{self.path}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as file:
+            file.write(data)
+        os.replace(temp_path, self.path)
+        return len(data)
+
+    async def save(self):
+        """Collect the caches on the loop, pickle and write them on a thread."""
+        start = time.perf_counter()
+        state = self.collect()
+        size = await asyncio.get_event_loop().run_in_executor(None, self.write, state)
+        logging.info(f"Cache snapshot of {size} bytes saved in {time.perf_counter() - start:.3f}s")
+
+    def restore(self):
+        try:
+            with open(self.path, "rb") as file:
+                state = pickle.loads(zlib.decompress(file.read()))
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logging.warning(f"Unable to read the cache snapshot {self.path}: {e!r}")
+            return False
+        elapsed = time.time() - state["taken_at"]
+        if state.get("version") != VERSION or elapsed > SNAPSHOT_MAX_AGE:
+            logging.info(f"Ignoring the cache snapshot taken {elapsed:.0f}s ago")
+            return False
+        for name, cache_state in state["caches"].items():
+            if name in self.caches and cache_state is not None:
+                try:
+                    self.caches[name].restore(cache_state, elapsed)
+                except Exception as e:
+                    logging.warning(f"Unable to restore the {name} cache snapshot: {e!r}")
+        logging.info(f"Caches restored from the snapshot taken {elapsed:.0f}s ago")
+        return True
+
+    def start(self, loop):
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                await self.save()
+            except Exception as e:
+                logging.warning(f"Unable to save the cache snapshot: {e!r}")
+
+    async def close(self):
+        """Stop the periodic saves and save one last time."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.save()
+        except Exception as e:
+            logging.warning(f"Unable to save the cache snapshot: {e!r}")
@@ -0,0 +1,61 @@
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from utils.metrics import metrics
+
+SLOW_COMMAND_THRESHOLD = float(os.getenv("SLOW_COMMAND_THRESHOLD", 2))
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+logger = logging.getLogger("legendarybot.trace")
+
+
+class CommandTrace:
+    """Wall time of a command invocation, split by where the time went (orm, http:<service>, discord)."""
+
+    __slots__ = ('command', 'guild_id', 'start', 'timings', 'calls')
+
+    def __init__(self, command, guild_id):
+        self.command = command
+        self.guild_id = guild_id
+        self.start = time.perf_counter()
+        self.timings = {}
+        self.calls = {}
+
+    def add(self, category, seconds):
+        self.timings[category] = self.timings.get(category, 0.0) + seconds
+        self.calls[category] = self.calls.get(category, 0) + 1
+
+    def finish(self, failed=False):
+        wall = time.perf_counter() - self.start
+        metrics.timing("legendarybot_command_latency", wall, command=self.command)
+        for category, seconds in self.timings.items():
+            metrics.timing("legendarybot_command_breakdown", seconds, command=self.command, category=category)
+        if wall >= SLOW_COMMAND_THRESHOLD:
+            # Concurrent calls overlap, so the categories can add up to more than the wall time.
+            logger.warning("Slow command %s", json.dumps({
+                "command": self.command,
+                "guild_id": self.guild_id,
+                "wall": round(wall, 4),
+                "timings": {category: round(seconds, 4) for category, seconds in self.timings.items()},
+                "calls": self.calls,
+                "failed": failed
+            }))
+        return wall
+
+
+@contextmanager
+def timed(category):
+    """Add the time spent in the block to the trace of the running command, if any."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(category, time.perf_counter() - start)